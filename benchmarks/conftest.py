@@ -0,0 +1,35 @@
+import tracemalloc
+
+import pytest
+
+peaks: dict[str, int] = {}
+
+
+@pytest.fixture
+def measure(request, benchmark):
+    """
+    Benchmark a call, first recording its peak memory allocation
+    (which is traced in a separate call, so as not to skew the timing).
+    """
+
+    def measure(func, *args, **kwargs):
+        tracemalloc.start()
+        try:
+            func(*args, **kwargs)
+            _, peak = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+        benchmark.extra_info['peak_memory'] = peak
+        peaks[request.node.nodeid] = peak
+        return benchmark(func, *args, **kwargs)
+
+    return measure
+
+
+def pytest_terminal_summary(terminalreporter):
+    if not peaks:
+        return
+    terminalreporter.section('peak memory (KiB)')
+    width = max(map(len, peaks))
+    for name, peak in sorted(peaks.items()):
+        terminalreporter.write_line(f'{name:<{width}} {peak / 1024:>12,.1f}')
@@ -0,0 +1,71 @@
+"""
+Synthetic OPC packages of configurable shape for benchmarking.
+"""
+
+import io
+import random
+import zipfile
+
+from openpack.basepack import Part
+from openpack.zippack import ZipPackage
+
+
+class SyntheticPart(Part):
+    content_type = 'application/vnd.openpack.synthetic+xml'
+    rel_type = 'http://openpack.example/relationships/synthetic'
+
+
+def part_name(number):
+    # zero-padded, so no name is a prefix of another (OPC 8.1.1.1)
+    return f'/synthetic/part{number:06d}.xml'
+
+
+def content(size, rng):
+    """
+    Generate an XML document of about size bytes of moderately
+    compressible text.
+    """
+    words = [f'{rng.getrandbits(24):06x}' for _ in range(64)]
+    chunks = [b'<synthetic>']
+    length = len(chunks[0])
+    while length < size:
+        text = ' '.join(rng.choices(words, k=16))
+        chunk = f'<item>{text}</item>'.encode('ascii')
+        chunks.append(chunk)
+        length += len(chunk)
+    chunks.append(b'</synthetic>')
+    return b''.join(chunks)
+
+
+def generate(parts=100, size=1024, fan_out=4, seed=0):
+    """
+    Generate a package of parts parts, each about size bytes, in a
+    tree of relationships in which the package and each part relates
+    to up to fan_out parts.
+    """
+    rng = random.Random(seed)
+    package = ZipPackage()
+    created = []
+    for number in range(parts):
+        part = SyntheticPart(package, part_name(number))
+        part.data = content(size, rng)
+        parent = package if number < fan_out else created[number // fan_out - 1]
+        parent.relate(part)
+        created.append(part)
+    # add the parts once related, so their relationships are included
+    for part in created:
+        package.add(part)
+    return package
+
+
+def write(package, filename, compression=zipfile.ZIP_DEFLATED):
+    """
+    Save package to filename, storing its members with compression.
+    """
+    stream = io.BytesIO()
+    package.save(stream)
+    source = zipfile.ZipFile(stream)
+    with zipfile.ZipFile(filename, 'w', compression) as zf:
+        for info in source.infolist():
+            zf.writestr(info.filename, source.read(info))
+    return filename
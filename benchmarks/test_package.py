@@ -0,0 +1,103 @@
+"""
+Benchmarks of the hot paths in loading, querying and saving packages,
+each over a range of sizes, so that the results chart how they scale.
+
+Run with ``tox -e bench``; see pytest-benchmark for options to compare
+runs (``--benchmark-autosave``, ``--benchmark-compare``).
+"""
+
+import io
+import zipfile
+
+import pytest
+
+from openpack.basepack import Relationships
+from openpack.zippack import ZipPackage
+
+from . import synthetic
+
+pytest.importorskip('pytest_benchmark')
+
+
+@pytest.fixture(params=[10, 100, 1000], ids='parts={}'.format)
+def parts(request):
+    return request.param
+
+
+@pytest.fixture
+def package(parts):
+    return synthetic.generate(parts)
+
+
+@pytest.fixture(
+    params=[zipfile.ZIP_DEFLATED, zipfile.ZIP_STORED], ids=['deflated', 'stored']
+)
+def compression(request):
+    return request.param
+
+
+@pytest.fixture
+def package_file(package, compression, tmp_path):
+    return synthetic.write(package, tmp_path / 'synthetic.zip', compression)
+
+
+@pytest.mark.parametrize('lazy', [False, True], ids='lazy={}'.format)
+def test_from_file(measure, package_file, lazy):
+    def load():
+        ZipPackage.from_file(package_file, lazy=lazy).close()
+
+    measure(load)
+
+
+def test_setitem(measure, package):
+    parts = [part for part in package.values() if not isinstance(part, Relationships)]
+
+    def assign():
+        target = ZipPackage()
+        for part in parts:
+            target[part.name] = part
+        # release the parts, so rounds don't accumulate packages storing them
+        for part in parts:
+            del target[part.name]
+
+    measure(assign)
+
+
+def test_find_for(measure, package):
+    names = list(package)
+    find_for = package.content_types.find_for
+
+    def find_all():
+        for name in names:
+            find_for(name)
+
+    measure(find_all)
+
+
+@pytest.fixture
+def fanned_out(parts):
+    "A package relating directly to each of its parts"
+    return synthetic.generate(parts, size=16, fan_out=parts)
+
+
+def test_relationships_dump(measure, fanned_out):
+    measure(fanned_out.relationships.dump)
+
+
+def test_relationships_load(measure, fanned_out):
+    data = fanned_out.relationships.dump()
+
+    def load():
+        Relationships(fanned_out, fanned_out).load(fanned_out, data)
+
+    measure(load)
+
+
+def test_store(measure, package):
+    measure(package._store, io.BytesIO())
+
+
+@pytest.mark.parametrize('size', [2**10, 2**14, 2**18], ids='size={}'.format)
+def test_store_by_size(measure, size):
+    package = synthetic.generate(50, size=size)
+    measure(package._store, io.BytesIO())
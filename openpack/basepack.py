@@ -2,20 +2,30 @@
 
 from __future__ import annotations
 
+import bisect
 import codecs
 import collections.abc
 import datetime
+import fnmatch
+import functools
+import hashlib
+import io
+import itertools
 import logging
 import os
 import posixpath
+import sys
+import tempfile
+import weakref
+import zlib
 from collections import defaultdict
 from typing import ClassVar
 
 from jaraco.collections import FoldedCaseKeyedDict
 from lxml.builder import ElementMaker as _ElementMaker
-from lxml.etree import Element, fromstring, tostring
+from lxml.etree import Element, fromstring, iterparse, tostring
 
-from .util import get_ext, parse_tag, validator
+from .util import get_ext, parse_tag, source_date_epoch, validator
 
 log = logging.getLogger(__name__)
 
@@ -46,16 +56,62 @@ class Relational:
     def related(self, reltype):
         """Return a list of parts related to this one via reltype."""
         package = getattr(self, 'package', None) or self
-        return [
-            package[posixpath.join(self.base, rel.target)]
-            for rel in self.relationships.types.get(reltype, [])
-        ]
-
-    def _load_rels(self, source):
-        """Load relationships from source XML."""
+        rels = self.relationships
+        if package.graph not in rels._graphs:
+            # not stored in its package (yet); read the rows directly
+            names = [
+                rel.part_name for rel in rels.of_type(reltype) if rel.mode == 'Internal'
+            ]
+            return [package[name] for name in names]
+        source = rels._source_name
+        return [package[name] for name in package.graph.targets(source, reltype)]
+
+    def _load_rels(self, source, origin=None):
+        """
+        Load relationships from source XML, optionally recording the
+        origin from which it was read (see Part.defer).
+        """
         # don't get confused here - the original source is string data;
         #  the parameter source below is a Part object
         self.relationships.load(source=self, data=source)
+        self.relationships._source = origin
+
+
+class Selection:
+    """
+    A predicate selecting the parts to load from a package by the type
+    of the relationship to each part, by part name (matching one of the
+    glob patterns in names, ignoring case) or by depth (the number of
+    relationships from the package to the part, at most max_depth).
+    Criteria that aren't given select every part.
+
+    >>> select = Selection(names=['/word/*'], max_depth=1)
+    >>> select('http://example.com/rel', '/word/document.xml', 1)
+    True
+    >>> select('http://example.com/rel', '/Word/Styles.xml', 2)
+    False
+    >>> select('http://example.com/rel', '/docProps/app.xml', 1)
+    False
+
+    Any callable taking the same parameters may be used in its place.
+    """
+
+    def __init__(self, rel_types=None, names=None, max_depth=None):
+        self.rel_types = None if rel_types is None else set(rel_types)
+        self.names = None if names is None else [name.lower() for name in names]
+        self.max_depth = max_depth
+
+    def __call__(self, rel_type, name, depth):
+        return (
+            (self.rel_types is None or rel_type in self.rel_types)
+            and (self.max_depth is None or depth <= self.max_depth)
+            and (
+                self.names is None
+                or any(
+                    fnmatch.fnmatchcase(name.lower(), pattern) for pattern in self.names
+                )
+            )
+        )
 
 
 class Package(collections.abc.MutableMapping, Relational):
@@ -71,12 +127,22 @@ class Package(collections.abc.MutableMapping, Relational):
 
     Instances of this class support dict-style access to parts via their
     part-names.
+
+    If reproducible is set (before the package is built), the package
+    is saved identically for identical content: parts are written in
+    order of name, timestamps are fixed (see util.source_date_epoch) and
+    relationship ids are assigned in sequence (rId1, rId2, ...).
     """
 
+    reproducible = False
+
     def __init__(self):
-        self.parts = {}
+        self.tree_cache = TreeCache()
+        self.graph = RelationshipGraph()
+        self.parts = Parts()
         self.base = '/'
         self.relationships = rels = Relationships(self, self)
+        rels._attach(self.graph)
         self[rels.name] = rels
         self.content_types = ContentTypes()
         self.content_types.add(ContentType.Default(rels.content_type, 'rels'))
@@ -85,17 +151,23 @@ class Package(collections.abc.MutableMapping, Relational):
         self._validate_part(name, part)
         self.parts[part.name] = part
         try:
-            if part.relationships:
-                self.parts[part.relationships.name] = part.relationships
+            rels = part.relationships
         except ValueError:
-            pass
+            return
+        rels._attach(self.graph)
+        if rels:
+            self.parts[rels.name] = rels
 
     def __getitem__(self, name):
         """Returns a part from the given URL."""
         return self.parts[name]
 
     def __delitem__(self, name):
-        del self.parts[name]
+        part = self.parts.pop(name)
+        try:
+            part.relationships._detach(self.graph)
+        except ValueError:
+            pass
 
     def __iter__(self):
         return iter(self.parts)
@@ -125,10 +197,8 @@ class Package(collections.abc.MutableMapping, Relational):
         # 8.1.1.1 -   A package implementer shall neither create nor
         # recognize a part with a part name derived from another part name by
         # appending segments to it
-        for cname in self:
-            assert not cname.startswith(name), (
-                f'The name {name} is a derivative of {cname}'
-            )
+        cname = next(self.parts.with_prefix(name), None)
+        assert cname is None, f'The name {name} is a derivative of {cname}'
         assert name == part.name, f"{name} != {part.name}"
         return part
 
@@ -145,23 +215,67 @@ class Package(collections.abc.MutableMapping, Relational):
             self._load_part(rel.name, some_file_like_object)
         """
 
+    def open_part(self, name, mode='rb'):
+        """
+        Open the named part as a binary file, to read its content (mode
+        'rb') or to write new content (mode 'wb').
+
+        Content written is spooled to a temporary file (which moves to
+        disk as it grows) and, once the file is closed, becomes the data
+        of the part as chunks, so it's saved without being held in
+        memory. If the file is closed by a with block that raises, the
+        part is left as it was.
+
+        Content held as chunks (such as content written as above) is
+        read as it's generated, without being joined in memory; such a
+        file can't seek.
+        """
+        part = self[name]
+        if mode == 'rb' and part._streams_data():
+            return io.BufferedReader(_ChunkReader(part.iter_dump()))
+        if mode == 'rb':
+            return io.BytesIO(part.dump())
+        if mode == 'wb':
+            return _PartWriter(part)
+        raise ValueError(f"invalid mode: {mode!r}")
+
     def _load_content_types(self, source):
         """Load up the content_types object with value from source XML."""
         self.content_types.update(ContentTypes.load(source))
 
-    def _load_part(self, rel_type, name, data):
+    def _load_part(self, rel_type, name, data, origin=None):
         """
-        Load a part into this package based on its relationship type
+        Load a part into this package based on its relationship type,
+        optionally recording the origin from which data was read (see
+        Part.defer).
         """
-        if self.content_types.find_for(name) is None:
-            log.warning('no content type found for part {name}'.format(**vars()))
+        part = self._new_part(rel_type, name)
+        if part is None:
             return
-        cls = Part.classes_by_rel_type[rel_type]
-        part = cls(self, name)
         part.load(data)
+        part._source = origin
         self[name] = part
         return part
 
+    def _defer_part(self, rel_type, name, source):
+        """
+        Like _load_part, but defer reading the part's data from source
+        until it is first needed.
+        """
+        part = self._new_part(rel_type, name)
+        if part is None:
+            return
+        part.defer(source)
+        self[name] = part
+        return part
+
+    def _new_part(self, rel_type, name):
+        if self.content_types.find_for(name) is None:
+            log.warning('no content type found for part {name}'.format(**vars()))
+            return
+        cls = Part.classes_by_rel_type[rel_type]
+        return cls(self, name)
+
     def __repr__(self):
         return "Package-%s" % id(self)
 
@@ -187,6 +301,338 @@ class Package(collections.abc.MutableMapping, Relational):
     def core_properties(self):
         return next(self.get_parts_by_class(CoreProperties))
 
+    def orphans(self):
+        """
+        Return the names of the parts (other than relationships parts)
+        that can't be reached by relationships from the package.
+        """
+        reachable = self.graph.reachable('/')
+        return [
+            name
+            for name, part in self.parts.items()
+            if name not in reachable and not isinstance(part, Relationships)
+        ]
+
+    def collect_garbage(self):
+        """
+        Remove the parts the package can't reach (see orphans), with
+        their content type overrides, and the relationships parts of
+        parts no longer in the package. Return the names removed.
+        """
+        removed = []
+        for name in self.orphans():
+            removed.extend(self._discard_part(name))
+        for name, part in list(self.parts.items()):
+            if isinstance(part, Relationships) and self._abandoned(part):
+                del self.parts[name]
+                removed.append(name)
+        return removed
+
+    def _discard_part(self, name):
+        """
+        Remove the named part, with its content type override and its
+        relationships part. Return the names removed.
+        """
+        part = self.parts[name]
+        del self[name]
+        for override in self.content_types._overrides_for(name):
+            self.content_types.discard(override)
+        rels = part.relationships
+        if self.parts.get(rels.name) is not rels:
+            return [name]
+        del self.parts[rels.name]
+        return [name, rels.name]
+
+    def _abandoned(self, rels):
+        source = rels.source
+        return source is not self and self.parts.get(source.name) is not source
+
+    def find_duplicates(self):
+        """
+        Return lists of the names of parts with identical content, each
+        in order of name. Only parts of the same class and content type
+        and without relationships of their own (such as media) are
+        compared.
+
+        Parts are compared by size and CRC-32 (taken from the zip file
+        for a part not yet loaded from one, see ZipPackage) and only
+        those that match are read, as streams, to compare by SHA-256.
+        """
+        by_checksum = defaultdict(list)
+        for name, part in self.parts.items():
+            if not self._comparable(part):
+                continue
+            content_type = getattr(self.content_types.find_for(name), 'name', None)
+            key = type(part), content_type, self._checksum(part)
+            by_checksum[key].append(name)
+        duplicates = []
+        for names in by_checksum.values():
+            if len(names) < 2:
+                continue
+            by_digest = defaultdict(list)
+            for name in sorted(names):
+                by_digest[self._digest(name)].append(name)
+            duplicates.extend(names for names in by_digest.values() if len(names) > 1)
+        return duplicates
+
+    def deduplicate(self):
+        """
+        Replace each set of parts with identical content (see
+        find_duplicates) with the first: relationships to the others are
+        retargeted to it and the others removed (see _discard_part).
+        Return a dict mapping the name of each part removed to the name
+        of the part that replaced it.
+        """
+        replaced = {
+            name: names[0] for names in self.find_duplicates() for name in names[1:]
+        }
+        for name, canonical in replaced.items():
+            for source in dict.fromkeys(self.graph.sources(name)):
+                holder = self if source == '/' else self.parts.get(source)
+                if holder is not None:
+                    holder.relationships._retarget(name, canonical)
+            self._discard_part(name)
+        return replaced
+
+    @staticmethod
+    def _comparable(part):
+        if isinstance(part, Relationships) or part.relationships.ids:
+            return False
+        # data that can only be iterated once can't be compared
+        data = vars(part).get('_data')
+        return not (_is_chunked(data) and iter(data) is data)
+
+    def _checksum(self, part):
+        """
+        Return the size and CRC-32 of the content of part.
+        """
+        size = crc = 0
+        for chunk in part.iter_dump():
+            crc = zlib.crc32(chunk, crc)
+            size += memoryview(chunk).nbytes
+        return size, crc
+
+    def _digest(self, name, chunk_size=2**16):
+        digest = hashlib.sha256()
+        with self.open_part(name) as file:
+            for chunk in iter(functools.partial(file.read, chunk_size), b''):
+                digest.update(chunk)
+        return digest.digest()
+
+
+class Parts(collections.abc.MutableMapping):
+    """
+    A mapping of part names to parts, preserving insertion order, which
+    also keeps the names sorted so that prefix queries (such as the
+    derived-name check in Package._validate_part) take logarithmic time.
+    """
+
+    def __init__(self):
+        self._parts = {}
+        self._names = []
+
+    def __getitem__(self, name):
+        return self._parts[name]
+
+    def __setitem__(self, name, part):
+        if name not in self._parts:
+            bisect.insort(self._names, name)
+        self._parts[name] = part
+
+    def __delitem__(self, name):
+        del self._parts[name]
+        del self._names[bisect.bisect_left(self._names, name)]
+
+    def __contains__(self, name):
+        return name in self._parts
+
+    def __iter__(self):
+        return iter(self._parts)
+
+    def __len__(self):
+        return len(self._parts)
+
+    def keys(self):
+        return self._parts.keys()
+
+    def values(self):
+        return self._parts.values()
+
+    def items(self):
+        return self._parts.items()
+
+    def with_prefix(self, prefix):
+        """
+        Generate the names starting with prefix, in sorted order.
+
+        >>> parts = Parts()
+        >>> for name in '/a/b', '/b', '/a/c', '/ab':
+        ...     parts[name] = None
+        >>> list(parts.with_prefix('/a/'))
+        ['/a/b', '/a/c']
+        >>> list(parts)
+        ['/a/b', '/b', '/a/c', '/ab']
+        """
+        names = self._names
+        for index in range(bisect.bisect_left(names, prefix), len(names)):
+            name = names[index]
+            if not name.startswith(prefix):
+                break
+            yield name
+
+
+class RelationshipGraph:
+    """
+    An index of the internal relationships in a package, as edges from
+    the name of the source part (or '/' for the package) to the name of
+    the target part, by relationship type, in both directions. It's
+    kept up to date as relationships and parts are added and removed.
+
+    >>> graph = RelationshipGraph()
+    >>> graph.add('/', '/doc.xml', 'document')
+    >>> graph.add('/doc.xml', '/media/a.png', 'image')
+    >>> graph.add('/doc.xml', '/style.xml', 'style')
+    >>> graph.targets('/doc.xml', 'image')
+    ['/media/a.png']
+    >>> graph.sources('/media/a.png')
+    ['/doc.xml']
+    >>> sorted(graph.reachable('/'))
+    ['/doc.xml', '/media/a.png', '/style.xml']
+    >>> graph.remove_source('/doc.xml')
+    >>> sorted(graph.reachable('/'))
+    ['/doc.xml']
+    """
+
+    def __init__(self):
+        # {source: {type: [target, ...]}} and {target: {type: [source, ...]}}
+        self._targets = {}
+        self._sources = {}
+
+    def add(self, source, target, reltype):
+        self._targets.setdefault(source, {}).setdefault(reltype, []).append(target)
+        self._sources.setdefault(target, {}).setdefault(reltype, []).append(source)
+
+    def remove(self, source, target, reltype):
+        self._discard(self._targets, source, reltype, target)
+        self._discard(self._sources, target, reltype, source)
+
+    def remove_source(self, source):
+        """
+        Remove the edges from source.
+        """
+        for reltype, targets in self._targets.pop(source, {}).items():
+            for target in targets:
+                self._discard(self._sources, target, reltype, source)
+
+    @staticmethod
+    def _discard(index, key, reltype, name):
+        by_type = index[key]
+        by_type[reltype].remove(name)
+        if not by_type[reltype]:
+            del by_type[reltype]
+        if not by_type:
+            del index[key]
+
+    def targets(self, source, reltype=None):
+        """
+        Return the names targeted from source (by reltype, if given).
+        """
+        return self._select(self._targets.get(source, {}), reltype)
+
+    def sources(self, target, reltype=None):
+        """
+        Return the names of the sources targeting target (by reltype,
+        if given).
+        """
+        return self._select(self._sources.get(target, {}), reltype)
+
+    @staticmethod
+    def _select(by_type, reltype):
+        if reltype is not None:
+            return list(by_type.get(reltype, []))
+        return list(itertools.chain.from_iterable(by_type.values()))
+
+    def reachable(self, *starts, reltype=None):
+        """
+        Return the set of names reachable from starts (by relationships
+        of reltype, if given), not including starts unless reached.
+        """
+        seen = set()
+        pending = list(starts)
+        while pending:
+            for name in self.targets(pending.pop(), reltype):
+                if name not in seen:
+                    seen.add(name)
+                    pending.append(name)
+        return seen
+
+
+class TreeCache:
+    """
+    The parsed XML trees of parts, by part name, holding the most
+    recently used trees whose XML totals no more than max_bytes.
+
+    >>> cache = TreeCache(max_bytes=16)
+    >>> a = Part(None, '/a.xml', data=b'<a><b/></a>')
+    >>> cache.parse(a) is cache.parse(a)
+    True
+    >>> cache.size
+    11
+    >>> _ = cache.parse(Part(None, '/c.xml', data=b'<c/>'))
+    >>> _ = cache.parse(Part(None, '/d.xml', data=b'<d/>'))
+    >>> '/a.xml' in cache, len(cache), cache.size
+    (False, 2, 8)
+    """
+
+    def __init__(self, max_bytes=2**26):
+        self.max_bytes = max_bytes
+        self.size = 0
+        self._entries = collections.OrderedDict()
+
+    def parse(self, part):
+        """
+        Return the tree of part, parsing its data if it isn't cached.
+        """
+        entry = self._entries.get(part.name)
+        if entry is not None and entry[0] is part:
+            self._entries.move_to_end(part.name)
+            return entry[1]
+        data = part.data
+        if isinstance(data, str):
+            data = data.encode('utf-8')
+        if _is_chunked(data):
+            raise ValueError(f"{part.name} is streamed and can't be parsed")
+        tree = fromstring(data)
+        self.discard(part)
+        self._entries[part.name] = part, tree, len(data)
+        self.size += len(data)
+        self._trim()
+        return tree
+
+    def discard(self, part):
+        """
+        Forget the tree of part, if cached.
+        """
+        entry = self._entries.get(part.name)
+        if entry is not None and entry[0] is part:
+            del self._entries[part.name]
+            self.size -= entry[2]
+
+    def clear(self):
+        self._entries.clear()
+        self.size = 0
+
+    def _trim(self):
+        while self.size > self.max_bytes:
+            _, (_, _, size) = self._entries.popitem(last=False)
+            self.size -= size
+
+    def __contains__(self, name):
+        return name in self._entries
+
+    def __len__(self):
+        return len(self._entries)
+
 
 class DefaultNamed:
     """
@@ -240,6 +686,7 @@ class Part(Relational, metaclass=RelationshipTypeHandler):
     content_type: str | None = None
     rel_type: str | None = None
     encoding: str
+    _source = None
 
     def __init__(self, package, name, **kwargs):
         # map(functools.partial(setattr, self), *kwargs.items())
@@ -272,23 +719,238 @@ class Part(Relational, metaclass=RelationshipTypeHandler):
 
     name = property(_get_name, _set_name)
 
+    @property
+    def data(self):
+        try:
+            return self._data
+        except AttributeError:
+            pass
+        if self._source is None:
+            raise AttributeError(f"{self.name} has no data")
+        self._load_source()
+        return self._data
+
+    @data.setter
+    def data(self, value):
+        self._data = value
+        self._source = None
+        self.invalidate()
+
+    @property
+    def tree(self):
+        """
+        The data of this part as an XML element.
+
+        Data held as bytes or text is parsed on first access and the
+        tree kept in the package's tree_cache until the data is next
+        loaded or assigned, so the data itself (and how it's saved) is
+        unchanged. To save changes made to the tree, assign it to data.
+        """
+        data = self.data
+        if isinstance(data, ElementClass):
+            return data
+        cache = getattr(self.package, 'tree_cache', None)
+        if cache is None:
+            return TreeCache().parse(self)
+        return cache.parse(self)
+
+    def invalidate(self):
+        """
+        Forget the bytes last dumped and the tree last parsed from the
+        data of this part. Assigning or loading data does so; call it
+        after changing data (such as an element) in place.
+        """
+        vars(self).pop('_dumped', None)
+        package = getattr(self, 'package', None)
+        cache = getattr(package, 'tree_cache', None)
+        if cache is not None:
+            cache.discard(self)
+
+    def _load_source(self):
+        """
+        Load the data of this part from its source.
+        """
+        source = self._source
+        self.load(source.read())
+        # loading from the source doesn't detach the part from it
+        self._source = source
+
+    def defer(self, source):
+        """
+        Arrange for the data of this part to be loaded from source (an
+        object whose read() method returns the raw bytes of the part) when
+        it is first accessed.
+        """
+        self._source = source
+
+    @property
+    def dirty(self):
+        """
+        Whether this part may differ from the source it was loaded from.
+
+        Parts not loaded from a source, or whose data has since been
+        assigned, are dirty. So are parts holding data that could have
+        been changed in place (such as an element tree) and parts that
+        customize dump, since such changes can't be detected.
+        """
+        if self._source is None or type(self).dump is not Part.dump:
+            return True
+        data = vars(self).get('_data')
+        return data is not None and not isinstance(data, (bytes, memoryview))
+
+    def evict(self):
+        """
+        Release the data of a part that was loaded from its source, so
+        it is read again on next access. Data assigned to the part is
+        never released. Return True if the data was released.
+        """
+        if self._source is None or '_data' not in vars(self):
+            return False
+        del self._data
+        self.invalidate()
+        return True
+
     def __iter__(self):
         """Should return an iterator for the underlying content."""
         return iter(self.data or [])
 
     def dump(self):
-        """Return the raw bytes of the Part."""
+        """
+        Return the raw bytes of the Part.
+
+        Bytes serialized from an element (or encoded from text) are
+        kept until the data is next assigned or loaded, so saving a
+        package again only serializes the parts that changed. Call
+        invalidate after changing an element in place.
+        """
+        try:
+            return self._dumped
+        except AttributeError:
+            pass
         data = self.data
         if isinstance(data, ElementClass):
-            data = tostring(data, encoding='utf-8', pretty_print=True)
+            self._dumped = tostring(data, encoding='utf-8', pretty_print=True)
+            return self._dumped
         if isinstance(data, str):
-            return data.encode('utf-8')
+            self._dumped = data.encode('utf-8')
+            return self._dumped
+        if _is_chunked(data):
+            return b''.join(_encode_chunks(data))
         return data
 
+    def iter_dump(self, chunk_size=2**16):
+        """
+        Generate the raw bytes of the Part in chunks.
+
+        The data of a part may itself be an iterable of bytes (or text)
+        chunks, such as a generator, in which case it's streamed without
+        ever being assembled in memory. Note that a generator can only
+        be consumed once.
+        """
+        data = self.data if type(self).dump is Part.dump else None
+        if _is_chunked(data):
+            yield from _encode_chunks(data)
+            return
+        view = memoryview(self.dump())
+        for start in range(0, len(view), chunk_size):
+            yield view[start : start + chunk_size]
+
+    def _streams_data(self):
+        """
+        Is the (loaded) data of this part an iterable of chunks?
+        """
+        return type(self).dump is Part.dump and _is_chunked(vars(self).get('_data'))
+
     def load(self, data):
         self.data = data
 
 
+def _is_chunked(data):
+    """
+    Is data an iterable of chunks (rather than content or an element)?
+    """
+    return isinstance(data, collections.abc.Iterable) and not isinstance(
+        data, (str, bytes, bytearray, memoryview, ElementClass)
+    )
+
+
+def _encode_chunks(chunks):
+    for chunk in chunks:
+        yield chunk.encode('utf-8') if isinstance(chunk, str) else chunk
+
+
+class _PartWriter(io.RawIOBase):
+    """
+    A file whose content becomes the data of part when it's closed.
+    """
+
+    def __init__(self, part, max_size=2**22):
+        self.part = part
+        self.file = tempfile.SpooledTemporaryFile(max_size)
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        return self.file.write(data)
+
+    def close(self):
+        if not self.closed and self.part is not None:
+            self.part.data = _Spool(self.file)
+        super().close()
+
+    def __exit__(self, exc_type, *exc_info):
+        if exc_type is not None:
+            self.part = None
+            self.file.close()
+        return super().__exit__(exc_type, *exc_info)
+
+
+class _ChunkReader(io.RawIOBase):
+    """
+    A file reading the content of an iterator of bytes chunks in turn.
+    """
+
+    def __init__(self, chunks):
+        self.chunks = chunks
+        self.pending = memoryview(b'')
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        while not self.pending:
+            chunk = next(self.chunks, None)
+            if chunk is None:
+                return 0
+            self.pending = memoryview(chunk).cast('B')
+        size = min(len(buffer), len(self.pending))
+        buffer[:size] = self.pending[:size]
+        self.pending = self.pending[size:]
+        return size
+
+
+class _Spool:
+    """
+    The content of a file as chunks, which may be iterated repeatedly.
+    """
+
+    def __init__(self, file, chunk_size=2**16):
+        self.file = file
+        self.chunk_size = chunk_size
+        weakref.finalize(self, file.close)
+
+    def __iter__(self):
+        position = 0
+        while chunk := self._read(position):
+            position += len(chunk)
+            yield chunk
+
+    def _read(self, position):
+        self.file.seek(position)
+        return self.file.read(self.chunk_size)
+
+
 class Relationship:
     """Represents an OPC relationship between a Package/Part and another Part.
 
@@ -299,6 +961,8 @@ class Relationship:
     mode : should be one of "Internal" or "External"
     """
 
+    __slots__ = ('id', 'mode', 'source', 'target', 'type')
+
     def __init__(self, source, target, reltype, id=None, mode=None):
         self.source = self._validate_source(source)
         self.target = self._validate_target(target)
@@ -310,6 +974,39 @@ class Relationship:
         args = (self.source, self.target, self.type, self.id, self.mode)
         return "Relationship({!r}, {!r}, {!r}, {!r}, {!r})".format(*args)
 
+    @property
+    def part_name(self):
+        """
+        The name of the part targeted (by an internal relationship),
+        resolved against the base of the source.
+        """
+        return _resolve(self.source.base, self.target)
+
+    def __eq__(self, other):
+        if not isinstance(other, Relationship):
+            return NotImplemented
+        return self.source is other.source and self._row() == other._row()
+
+    def __hash__(self):
+        return hash((id(self.source), self.id))
+
+    def _row(self):
+        return self.id, self.target, self.type, self.mode
+
+    @classmethod
+    def _from_row(cls, source, id, target, reltype, mode):
+        """
+        Materialize a relationship stored by Relationships, which was
+        validated when added.
+        """
+        rel = cls.__new__(cls)
+        rel.source = source
+        rel.id = id
+        rel.target = target
+        rel.type = reltype
+        rel.mode = mode
+        return rel
+
     @validator
     def _validate_source(self, source):
         assert isinstance(source, (Package, Part))
@@ -328,7 +1025,8 @@ class Relationship:
     @validator
     def _validate_id(self, id):
         if id is None:
-            return self._generate_id()
+            # numbered in sequence if the package is reproducible
+            return self.source.relationships._new_id()
         # TODO: The Id type is xsd:ID and it shall conform to the naming
         # restrictions for xsd:ID as specified in the W3C Recommendation
         # "XML Schema Part 2: Datatypes."
@@ -340,7 +1038,14 @@ class Relationship:
 
 
 class Relationships(Part):
-    """A collection of Package or Part Relationships."""
+    """
+    A collection of Package or Part Relationships.
+
+    The relationships are stored compactly, as rows of (interned)
+    target, type and mode by id, in the order added, with indexes of
+    the ids by type and by target. The Relationship objects are
+    materialized on demand.
+    """
 
     xmlns = "{http://schemas.openxmlformats.org/package/2006/relationships}"
     content_type = "application/vnd.openxmlformats-package.relationships+xml"
@@ -354,9 +1059,13 @@ class Relationships(Part):
         """
         name = self._name_from_source(source)
         Part.__init__(self, package, name)
-        self.ids = set()
-        self.children = set()
-        self.types = {}
+        self.source = source
+        self._rows = {}
+        self._by_type = {}
+        self._by_target = {}
+        # the graphs of the packages storing the source, held weakly so
+        #  a package that's discarded doesn't linger
+        self._graphs = weakref.WeakSet()
         self.encoding = encoding or 'utf-8'
 
     class _relationships:
@@ -368,6 +1077,18 @@ class Relationships(Part):
 
     relationships = _relationships()
 
+    @property
+    def data(self):
+        raise AttributeError("Relationship parts are generated by dump.")
+
+    @data.setter
+    def data(self, value):
+        raise AttributeError("Relationship parts are generated by dump.")
+
+    @property
+    def dirty(self):
+        return self._source is None
+
     def dump(self):
         rels = Element(
             self.xmlns + 'Relationships', nsmap={None: self.xmlns.strip('{}')}
@@ -387,37 +1108,161 @@ class Relationships(Part):
     def load(self, source, data):
         """
         @param source The source Part for each relationship in this
-        collection
+        collection (the source of this collection)
         @ptype source Part
-        @param data Relationship XML from a previous dump operation
-        @ptype data string
-        """
-        elem = fromstring(data)
-        for rel in elem:
-            mode = rel.get('TargetMode')
-            target = rel.get('Target')
-            rtype = rel.get('Type')
-            id = rel.get('Id')
-            relationship = Relationship(source, target, rtype, id, mode)
-            self.add(relationship)
+        @param data Relationship XML from a previous dump operation, or
+        a file-like object from which to read it
+        @ptype data bytes or file
+
+        The XML is parsed incrementally, each element being released once
+        its relationship is added, so only the relationships are retained.
+        """
+        if isinstance(data, str):
+            data = data.encode('utf-8')
+        stream = data if hasattr(data, 'read') else io.BytesIO(data)
+        for _, rel in iterparse(stream, tag='{*}Relationship'):
+            self._add_row(
+                rel.get('Id') or self._new_id(),
+                rel.get('Target'),
+                rel.get('Type'),
+                rel.get('TargetMode') or 'Internal',
+            )
+            _release(rel)
 
     def __iter__(self):
-        return iter(self.children)
+        return map(self._materialize, self._rows)
 
     def __repr__(self):
-        return "\n".join([repr(c) for c in self.children])
+        return "\n".join([repr(c) for c in self])
+
+    def _materialize(self, id):
+        return Relationship._from_row(self.source, id, *self._rows[id])
 
     def add(self, rel):
-        self.ids.add(self._validate_id(rel.id))
-        self.children.add(rel)
-        self.types.setdefault(rel.type, []).append(rel)
+        self._source = None
+        self._add_row(rel.id, rel.target, rel.type, rel.mode)
 
     @validator
-    def _validate_id(self, id):
+    def _add_row(self, id, target, reltype, mode):
+        assert isinstance(target, str), "target must be a part name"
+        assert mode in ("Internal", "External")
         # The value of the Id attribute shall be
         # unique within the Relationships part.
-        assert id not in self.ids
-        return id
+        assert id not in self._rows
+        target, reltype, mode = map(_intern, (target, reltype, mode))
+        self._rows[id] = target, reltype, mode
+        self._by_type.setdefault(reltype, []).append(id)
+        self._by_target.setdefault(target, []).append(id)
+        self._link(target, reltype, mode)
+
+    @property
+    def _source_name(self):
+        return '/' if isinstance(self.source, Package) else self.source.name
+
+    def _link(self, target, reltype, mode, graphs=None):
+        """
+        Add the edge for a relationship to the graphs of the packages
+        storing the source.
+        """
+        graphs = self._graphs if graphs is None else graphs
+        if not graphs or mode != 'Internal':
+            return
+        source, target = self._source_name, _resolve(self.source.base, target)
+        for graph in graphs:
+            graph.add(source, target, reltype)
+
+    def _unlink(self, target, reltype, mode):
+        if not self._graphs or mode != 'Internal':
+            return
+        source, target = self._source_name, _resolve(self.source.base, target)
+        for graph in self._graphs:
+            graph.remove(source, target, reltype)
+
+    def _attach(self, graph):
+        """
+        Link the relationships into graph, once the source is stored in
+        its package.
+        """
+        if graph in self._graphs:
+            return
+        self._graphs.add(graph)
+        for target, reltype, mode in self._rows.values():
+            self._link(target, reltype, mode, graphs=[graph])
+
+    def _detach(self, graph):
+        """
+        Unlink the relationships from graph, once the source is removed
+        from its package.
+        """
+        if graph not in self._graphs:
+            return
+        self._graphs.discard(graph)
+        graph.remove_source(self._source_name)
+
+    def _retarget(self, part_name, new_name):
+        """
+        Point the internal relationships to part_name at new_name.
+        """
+        base = self.source.base
+        targets = [
+            target
+            for target, ids in self._by_target.items()
+            if self._rows[ids[0]][2] == 'Internal'
+            and _resolve(base, target) == part_name
+        ]
+        for target in targets:
+            relative = posixpath.relpath(new_name, base)
+            new_target = _intern(new_name if target.startswith('/') else relative)
+            ids = self._by_target.pop(target)
+            for id in ids:
+                _, reltype, mode = self._rows[id]
+                self._rows[id] = new_target, reltype, mode
+                self._unlink(target, reltype, mode)
+                self._link(new_target, reltype, mode)
+            self._by_target.setdefault(new_target, []).extend(ids)
+            self._source = None
+
+    def __getitem__(self, id):
+        """
+        Return the relationship with id.
+        """
+        if id not in self._rows:
+            raise KeyError(id)
+        return self._materialize(id)
+
+    def _new_id(self):
+        """
+        Return an id for a new relationship: the first unused id of the
+        form rIdN for a reproducible package, otherwise a random one.
+        """
+        if not getattr(self.package, 'reproducible', False):
+            return Relationship._generate_id()
+        ids = (f'rId{number}' for number in itertools.count(len(self._rows) + 1))
+        return next(id for id in ids if id not in self._rows)
+
+    def of_type(self, reltype):
+        """
+        Return the relationships of reltype.
+        """
+        return list(map(self._materialize, self._by_type.get(reltype, [])))
+
+    def to_target(self, target):
+        """
+        Return the relationships to target.
+        """
+        return list(map(self._materialize, self._by_target.get(target, [])))
+
+    @property
+    def ids(self):
+        return self._rows.keys()
+
+    @property
+    def children(self):
+        return set(self)
+
+    @property
+    def types(self):
+        return {reltype: self.of_type(reltype) for reltype in self._by_type}
 
     def _name_from_source(self, source):
         if isinstance(source, Package):
@@ -426,11 +1271,136 @@ class Relationships(Part):
         return posixpath.join(base, '_rels/%s.rels' % item)
 
 
+def _resolve(base, target):
+    """
+    Resolve a relationship target against the base of its source.
+
+    >>> _resolve('/word', '../media/image1.png')
+    '/media/image1.png'
+    """
+    return posixpath.normpath(posixpath.join(base, target))
+
+
+def _intern(value):
+    return sys.intern(value) if type(value) is str else value
+
+
+def _release(elem):
+    """
+    Free elem and any preceding siblings from the tree being parsed.
+    """
+    elem.clear(keep_tail=True)
+    parent = elem.getparent()
+    while elem.getprevious() is not None:
+        del parent[0]
+
+
 class ContentTypes(set):
-    """A container for managing Package content types."""
+    """
+    A container for managing Package content types.
+
+    In addition to the set of items, maintains case-insensitive indexes
+    of the overrides by part name and of the defaults by extension, so
+    find_for is a constant-time lookup. Each index maps a key to the
+    items with that key (in the order added, the last taking effect),
+    so items are also removed in constant time.
+    """
 
     xmlns = '{http://schemas.openxmlformats.org/package/2006/content-types}'
 
+    def __init__(self, items=()):
+        super().__init__()
+        self._defaults = FoldedCaseKeyedDict()
+        self._overrides = FoldedCaseKeyedDict()
+        self.update(items)
+
+    def _index_for(self, item):
+        if isinstance(item, ContentType.Override):
+            return self._overrides
+        return self._defaults
+
+    def add(self, item):
+        if item in self:
+            return
+        super().add(item)
+        index = self._index_for(item)
+        index.setdefault(item.key, {})[item] = None
+
+    def discard(self, item):
+        if item not in self:
+            return
+        super().discard(item)
+        self._unindex(item)
+
+    def remove(self, item):
+        if item not in self:
+            raise KeyError(item)
+        self.discard(item)
+
+    def pop(self):
+        item = super().pop()
+        self._unindex(item)
+        return item
+
+    def clear(self):
+        super().clear()
+        self._defaults.clear()
+        self._overrides.clear()
+
+    def _unindex(self, item):
+        index = self._index_for(item)
+        items = index[item.key]
+        del items[item]
+        if not items:
+            del index[item.key]
+
+    @staticmethod
+    def _lookup(index, key):
+        items = index.get(key)
+        return next(reversed(items)) if items else None
+
+    def _overrides_for(self, name):
+        return list(self._overrides.get(name, ()))
+
+    def update(self, *others):
+        for other in others:
+            for item in other:
+                self.add(item)
+
+    def difference_update(self, *others):
+        for other in others:
+            for item in list(other):
+                self.discard(item)
+
+    def intersection_update(self, *others):
+        keep = set(self).intersection(*others)
+        for item in list(self):
+            if item not in keep:
+                self.discard(item)
+
+    def symmetric_difference_update(self, other):
+        for item in set(other):
+            if item in self:
+                self.discard(item)
+            else:
+                self.add(item)
+
+    def __ior__(self, other):  # type: ignore[misc]
+        self.update(other)
+        return self
+
+    def __isub__(self, other):  # type: ignore[misc]
+        self.difference_update(other)
+        return self
+
+    def __iand__(self, other):  # type: ignore[misc]
+        self.intersection_update(other)
+        return self
+
+    def __ixor__(self, other):  # type: ignore[misc]
+        self.symmetric_difference_update(other)
+        return self
+
     def add_override(self, part):
         ct = ContentType.Override(part.content_type, part.name)
         self.add(ct)
@@ -452,9 +1422,14 @@ class ContentTypes(set):
 
     def to_element(self):
         elem = Element(self.xmlns + 'Types', nsmap={None: self.xmlns.strip('{}')})
-        elem.extend(ct.to_element() for ct in self)
+        elem.extend(ct.to_element() for ct in sorted(self, key=self._sort_key))
         return elem
 
+    @staticmethod
+    def _sort_key(item):
+        "Defaults then overrides, each by key, for a stable rendering"
+        return isinstance(item, ContentType.Override), item.key
+
     @classmethod
     def from_element(cls, elem):
         ns, tag = parse_tag(elem.tag)
@@ -472,11 +1447,14 @@ class ContentTypes(set):
         """
         Get the correct content type for a given name
         """
-        map = self.items
         # first search the overrides (by name)
         # then fall back to the defaults (by extension)
         # finally, return None if unmatched
-        return map.get(name, None) or map.get(get_ext(name) or None, None)
+        found = self._lookup(self._overrides, name)
+        if found is None:
+            ext = get_ext(name)
+            found = self._lookup(self._defaults, ext) if ext else None
+        return found
 
     # a couple of properties for backward compatibility - please don't
     #  try to write to the resultant collections
@@ -497,6 +1475,8 @@ class ContentType:
     application/xml, and a key which refers to the content type.
     """
 
+    __slots__ = ('key', 'name')
+
     Default: ClassVar[type[ContentType]]
     Override: ClassVar[type[ContentType]]
 
@@ -528,8 +1508,7 @@ class ContentType:
         return class_(name, key)
 
     def __repr__(self):
-        params = dict(class_name=self.__class__.__name__, **self.__dict__)
-        return "{class_name}({name!r}, {key!r})".format(**params)
+        return f"{self.__class__.__name__}({self.name!r}, {self.key!r})"
 
     def __eq__(self, other):
         """
@@ -549,6 +1528,8 @@ class ContentType:
 class Default(ContentType):
     """A Default content type, based on a file extension."""
 
+    __slots__ = ()
+
     key_name = 'Extension'
 
 
@@ -559,6 +1540,8 @@ del Default
 class Override(ContentType):
     """An Override content type, based on a part name."""
 
+    __slots__ = ()
+
     key_name = 'PartName'
 
 
@@ -617,6 +1600,11 @@ class CoreProperties(Part):
     def __init__(self, package, name):
         Part.__init__(self, package, name)
 
+    def defer(self, source):
+        # the properties are attributes rather than data, so they can't
+        #  be loaded on demand; they're small, so load them now.
+        self.load(source.read())
+
     def load(self, data):
         xml = fromstring(data)
 
@@ -628,16 +1616,14 @@ class CoreProperties(Part):
                 value = transform(elem.text)
                 setattr(self, attr, value)
 
-        map(
-            set_attr_if_tag,
-            (
-                DC('title'),
-                DC('subject'),
-                DC('creator'),
-                CP('keywords'),
-                DC('description'),
-            ),
-        )
+        for tag in (
+            DC('title'),
+            DC('subject'),
+            DC('creator'),
+            CP('keywords'),
+            DC('description'),
+        ):
+            set_attr_if_tag(tag)
         set_attr_if_tag(CP('revision'), transform=int)
         set_attr_if_tag(CP('lastModifiedBy'), 'last_modified_by')
 
@@ -656,7 +1642,12 @@ class CoreProperties(Part):
 
     def to_element(self):
         # some datetime handling
-        now = datetime.datetime.now()
+        if getattr(self.package, 'reproducible', False):
+            now = datetime.datetime.fromtimestamp(
+                source_date_epoch(), datetime.timezone.utc
+            ).replace(tzinfo=None)
+        else:
+            now = datetime.datetime.now()
         if self.created is None:
             self.created = now
         if self.modified is None:
@@ -0,0 +1,225 @@
+"""
+Process many packages at once, in a pool of processes, writing a JSON
+object for each package on a line of output (JSON Lines).
+
+Each line has the path of the package and either the result of the
+operation or, if it failed, the error, so a corrupt package doesn't
+interrupt the run.
+"""
+
+from __future__ import annotations
+
+import argparse
+import concurrent.futures
+import contextlib
+import fnmatch
+import functools
+import glob
+import inspect
+import json
+import operator
+import os
+import posixpath
+import sys
+import zipfile
+from collections.abc import Callable
+
+from .basepack import Relationships
+from .zippack import ZipPackage
+
+default_patterns = (
+    '*.doc[xm]',
+    '*.dot[xm]',
+    '*.xls[xmb]',
+    '*.xlt[xm]',
+    '*.ppt[xm]',
+    '*.pot[xm]',
+    '*.pps[xm]',
+    '*.zipx',
+)
+
+operations: dict[str, Callable[[str], object]] = {}
+
+
+def operation(func):
+    "Register func as an operation, named for the function"
+    operations[func.__name__.replace('_', '-')] = func
+    return func
+
+
+@operation
+def parts(path):
+    "The name and content type of each part"
+    with ZipPackage.from_file(path, lazy=True) as package:
+        find_for = package.content_types.find_for
+        return [
+            {'name': name, 'content_type': getattr(find_for(name), 'name', None)}
+            for name in package
+        ]
+
+
+@operation
+def content_types(path):
+    "The default and override content types"
+    with ZipPackage.from_file(path, lazy=True) as package:
+        items = [
+            {'kind': type(item).__name__, 'key': item.key, 'content_type': item.name}
+            for item in package.content_types
+        ]
+    return sorted(items, key=operator.itemgetter('kind', 'key'))
+
+
+@operation
+def core_properties(path):
+    "The core properties (or null if there are none)"
+    props = ZipPackage.read_core_properties(path)
+    if props is None:
+        return None
+    names = (
+        'title',
+        'subject',
+        'creator',
+        'keywords',
+        'description',
+        'last_modified_by',
+        'revision',
+        'created',
+        'modified',
+    )
+    return {name: getattr(props, name) for name in names}
+
+
+@operation
+def validate(path):
+    "Load every part, checking that each relationship resolves"
+    with zipfile.ZipFile(path) as zf:
+        members = set(zf.namelist())
+    problems = []
+    with ZipPackage.from_file(path) as package:
+        sources = [package]
+        sources.extend(
+            part
+            for part in package.parts.values()
+            if not isinstance(part, Relationships)
+        )
+        for source in sources:
+            problems.extend(_check_relationships(package, source, members))
+    return {'valid': not problems, 'problems': problems}
+
+
+def _check_relationships(package, source, members):
+    for rel in source.relationships:
+        if rel.mode == 'External':
+            continue
+        target = rel.part_name
+        name = target.lstrip('/')
+        if name not in members and posixpath.join(name, '[0].piece') not in members:
+            yield f'{source.relationships.name}: {rel.id} targets missing {target}'
+        elif target not in package:
+            yield f'{source.relationships.name}: {rel.id} targets {target} of no type'
+
+
+def process(name, path):
+    "Apply the named operation to the package at path, capturing any error"
+    try:
+        return {'path': path, 'result': operations[name](path)}
+    except Exception as exc:
+        return {'path': path, 'error': f'{type(exc).__name__}: {exc}'}
+
+
+def find_packages(paths, patterns=default_patterns):
+    """
+    Generate the files for paths, each a file, a glob or a directory
+    (searched recursively for files matching patterns).
+    """
+    for path in paths:
+        if os.path.isdir(path):
+            yield from _search(path, patterns)
+        elif glob.has_magic(path):
+            yield from sorted(filter(os.path.isfile, glob.iglob(path, recursive=True)))
+        else:
+            yield path
+
+
+def _search(directory, patterns):
+    for root, dirs, files in os.walk(directory):
+        dirs.sort()
+        for name in sorted(files):
+            if any(fnmatch.fnmatch(name, pattern) for pattern in patterns):
+                yield os.path.join(root, name)
+
+
+def run(name, paths, workers=None, out=sys.stdout, report=None):
+    """
+    Apply the named operation to the packages at paths in a pool of
+    workers processes (or in this process if workers is 0), writing
+    the results to out in order. If supplied, call report with the
+    number of packages done, the total and the number of errors after
+    each. Return the number of errors.
+    """
+    paths = list(paths)
+    func = functools.partial(process, name)
+    errors = 0
+    pool = (
+        contextlib.nullcontext()
+        if workers == 0
+        else concurrent.futures.ProcessPoolExecutor(workers)
+    )
+    with pool as executor:
+        results = (
+            executor.map(func, paths, chunksize=8) if executor else map(func, paths)
+        )
+        for done, result in enumerate(results, 1):
+            print(json.dumps(result, default=_serialize), file=out)
+            errors += 'error' in result
+            if report:
+                report(done, len(paths), errors)
+    return errors
+
+
+def _serialize(value):
+    "Render values JSON doesn't support, such as datetimes"
+    return value.isoformat() if hasattr(value, 'isoformat') else str(value)
+
+
+def report_progress(done, total, errors, stream=sys.stderr):
+    stream.write(f'\r{done}/{total} packages, {errors} errors')
+    if done == total:
+        stream.write('\n')
+    stream.flush()
+
+
+def batch_cmd():
+    'Apply an operation to many OOXML packages, emitting JSON Lines'
+    parser = argparse.ArgumentParser(description=inspect.getdoc(batch_cmd))
+    parser.add_argument('operation', choices=sorted(operations))
+    parser.add_argument(
+        'paths',
+        nargs='+',
+        metavar='path',
+        help='package file, glob or directory (searched recursively)',
+    )
+    parser.add_argument(
+        '--pattern',
+        action='append',
+        help=(
+            'file name pattern for packages in directories '
+            f'(default: {", ".join(default_patterns)})'
+        ),
+    )
+    parser.add_argument(
+        '--workers',
+        type=int,
+        help='number of processes (default: one per CPU; 0 for none)',
+    )
+    parser.add_argument(
+        '--progress',
+        action=argparse.BooleanOptionalAction,
+        default=sys.stderr.isatty(),
+        help='report progress on stderr (default: if it is a terminal)',
+    )
+    args = parser.parse_args()
+    paths = find_packages(args.paths, args.pattern or default_patterns)
+    report = report_progress if args.progress else None
+    errors = run(args.operation, paths, args.workers, report=report)
+    raise SystemExit(bool(errors))
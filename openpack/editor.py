@@ -100,7 +100,9 @@ class EditableFile:
 
 def part_edit(path, reformat_xml):
     file, ipath = find_file(path)
-    pkg = Package.from_file(file)
+    # only the edited part needs to be read; the rest are copied as
+    #  stored when the package is saved.
+    pkg = Package.from_file(file, lazy=True)
     if ipath.startswith('[Content-Types]'):
         part = pkg.content_types
     else:
@@ -113,6 +115,7 @@ def part_edit(path, reformat_xml):
     if ef.changed:
         part.load(ef.data)
         pkg.save()
+    pkg.close()
 
 
 def list_contents(path):
@@ -0,0 +1,3 @@
+import openpack.batch
+
+__name__ == '__main__' and openpack.batch.batch_cmd()
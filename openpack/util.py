@@ -1,3 +1,4 @@
+import os
 import re
 
 
@@ -38,3 +39,19 @@ def get_ext(name):
     """
     other, sep, ext = name.partition('.')
     return ext
+
+
+# 1980-01-01, the earliest time a zip file can record
+_ZIP_EPOCH = 315532800
+
+
+def source_date_epoch():
+    """
+    Return the time (in seconds since the epoch) to record in
+    reproducible output: SOURCE_DATE_EPOCH, if set, or otherwise the
+    earliest time a zip file can record.
+
+    >>> source_date_epoch() >= _ZIP_EPOCH
+    True
+    """
+    return max(int(os.environ.get('SOURCE_DATE_EPOCH', _ZIP_EPOCH)), _ZIP_EPOCH)
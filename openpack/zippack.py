@@ -6,13 +6,47 @@ Package-...
 Relationship(Package-..., 'word/document.xml', 'http://schemas.openxml...', ...)
 """
 
+import asyncio
+import bisect
+import collections
+import concurrent.futures
+import contextlib
+import fnmatch
 import functools
+import inspect
 import io
+import itertools
+import mmap
+import operator
+import os
 import posixpath
+import re
+import shutil
+import struct
+import tempfile
 import time
-from zipfile import ZIP_DEFLATED, ZipFile, ZipInfo
+import zipfile
+import zlib
+from zipfile import (
+    ZIP64_LIMIT,
+    ZIP_DEFLATED,
+    ZIP_LZMA,
+    ZIP_STORED,
+    BadZipFile,
+    ZipFile,
+    ZipInfo,
+)
 
-from .basepack import Package, Part, Relationships
+from .basepack import CoreProperties, Package, Part, Relationships, Selection
+from .util import source_date_epoch
+
+# general purpose flags, the data descriptor signature and the fixed size
+#  of a local file header (APPNOTE 4.3.7, 4.3.9)
+_MASK_ENCRYPTED = 0x01
+_MASK_COMPRESS_OPTION_1 = 0x02
+_MASK_USE_DATA_DESCRIPTOR = 0x08
+_DD_SIGNATURE = 0x08074B50
+_FILE_HEADER_SIZE = 30
 
 
 def to_zip_name(name):
@@ -23,56 +57,391 @@ def to_zip_name(name):
     return name.lstrip('/')
 
 
+class CompressionPolicy:
+    """
+    Decide how each part of a package is compressed when it's saved,
+    returning a (compress_type, compresslevel) pair for its zip entry.
+
+    Parts of one of the stored_types (or whose names match one of the
+    stored_names glob patterns, ignoring case), already-compressed media
+    by default, are stored. Other parts are deflated: at small_level if
+    their size is less than small_size, at large_level if it's at least
+    large_size, or else at the default level. (The size of streamed data
+    isn't known, so it's deflated at the default level.)
+
+    If sample is True, a part not stored by type or name is also stored
+    if deflating the first chunk of its content (sample) at the fastest
+    level saves less than min_saving of it.
+
+    >>> policy = CompressionPolicy(sample=True)
+    >>> policy('/ppt/media/image1.png', 'image/png', 2**20, b'...')
+    (0, None)
+    >>> policy('/ppt/slides/slide1.xml', 'application/xml', 600, b'<sld/>' * 100)
+    (8, 9)
+    >>> policy('/ppt/embeddings/data.bin', None, None, os.urandom(2**10))
+    (0, None)
+
+    Any callable taking the same parameters may be used in its place.
+    """
+
+    stored_types = ('image/png', 'image/jpeg', 'image/gif', 'video/*', 'audio/*')
+    stored_names = (
+        '*.png',
+        '*.jp*g',
+        '*.gif',
+        '*.mp[34]',
+        '*.m4[av]',
+        '*.mov',
+        '*.wm[av]',
+        '*.zip',
+        '*.docx',
+        '*.xlsx',
+        '*.pptx',
+    )
+
+    def __init__(
+        self,
+        stored_types=stored_types,
+        stored_names=stored_names,
+        small_size=2**16,
+        small_level=9,
+        large_size=2**22,
+        large_level=1,
+        sample=False,
+        min_saving=0.1,
+    ):
+        self.stored_types = [name.lower() for name in stored_types]
+        self.stored_names = [name.lower() for name in stored_names]
+        self.small_size = small_size
+        self.small_level = small_level
+        self.large_size = large_size
+        self.large_level = large_level
+        self.sample = sample
+        self.min_saving = min_saving
+
+    def __call__(self, name, content_type, size, sample):
+        if self._stored(name, content_type) or self._incompressible(sample):
+            return ZIP_STORED, None
+        if size is None:
+            return ZIP_DEFLATED, None
+        if size < self.small_size:
+            return ZIP_DEFLATED, self.small_level
+        if size >= self.large_size:
+            return ZIP_DEFLATED, self.large_level
+        return ZIP_DEFLATED, None
+
+    def _stored(self, name, content_type):
+        return any(
+            fnmatch.fnmatchcase(content_type.lower(), pattern)
+            for pattern in self.stored_types
+            if content_type
+        ) or any(
+            fnmatch.fnmatchcase(name.lower(), pattern) for pattern in self.stored_names
+        )
+
+    def _incompressible(self, sample):
+        if not self.sample or not sample:
+            return False
+        sample = memoryview(sample)[: 2**16]
+        compressed = zlib.compress(sample, 1)
+        return len(compressed) > len(sample) * (1 - self.min_saving)
+
+
 class ZipPackage(Package):
+    """
+    A package stored as a zip file.
+
+    Each part is compressed as its compression policy (a
+    CompressionPolicy by default) decides.
+    """
+
+    compression = CompressionPolicy()
+    _archive = None
+    # set if parts were left out when loading selectively
+    _partial = False
+
     @classmethod
-    def from_file(cls, filename):
-        with open(filename, 'rb') as stream:
-            package = cls.from_stream(stream)
-        package.filename = filename
+    def from_file(
+        cls, filename, lazy=False, workers=None, memory_map=False, select=None
+    ):
+        """
+        Load a package from the zip file at filename.
+
+        If lazy is True, the parts are registered from the relationships
+        and content types, but the data of each part is only read from
+        the file when first accessed (and may be released again with
+        Part.evict). The file remains open until the package is closed.
+
+        Otherwise, if workers is given, the relationships are resolved
+        first and then the parts are decompressed and loaded (parsed)
+        in parallel by that many threads.
+
+        If memory_map is True, the file is mapped into memory (until the
+        package is closed) rather than read. The data of parts stored
+        uncompressed is then a memoryview of the mapping (and its CRC
+        is not checked), while compressed parts are decompressed
+        directly from the mapping.
+
+        If select is given, only the parts it selects (see
+        basepack.Selection) are loaded, and the parts related to them
+        are not explored. Such a package is incomplete and can't be
+        saved.
+        """
+        package = cls()
+        load = functools.partial(
+            package._load, filename=filename, workers=workers, select=select
+        )
+        if memory_map:
+            with open(filename, 'rb') as stream:
+                mapping = mmap.mmap(stream.fileno(), 0, access=mmap.ACCESS_READ)
+            load(mapping, lazy=lazy)
+        elif lazy:
+            load(filename, lazy=True)
+        else:
+            with open(filename, 'rb') as stream:
+                load(stream)
+        package.filename = os.fspath(filename)
         return package
 
     @classmethod
-    def from_stream(cls, stream):
+    def from_stream(cls, stream, lazy=False, workers=None, select=None):
+        """
+        Load a package from a seekable stream. See from_file for the
+        meaning of lazy, workers and select; when lazy, the stream must
+        remain open until the package is closed.
+        """
         package = cls()
-        package._load(stream)
+        package._load(stream, lazy=lazy, workers=workers, select=select)
         return package
 
-    def _load(self, stream):
+    @classmethod
+    async def aopen(cls, source, executor=None, select=None):
+        """
+        Load a package from source, a filename or an asynchronous stream
+        (whose read method is a coroutine, like asyncio.StreamReader),
+        without blocking the event loop: the relationships and then each
+        part are read and parsed by a separate call in executor (the
+        loop's default executor if None). See from_file for select.
+        """
+        loop = asyncio.get_running_loop()
+        package = cls()
+        load = functools.partial(package._load, lazy=True, select=select)
+        if isinstance(source, str):
+            load = functools.partial(load, source, filename=source)
+        else:
+            load = functools.partial(load, io.BytesIO(await source.read()))
+        await loop.run_in_executor(executor, load)
+        for part in package._deferred():
+            await loop.run_in_executor(executor, part._load_source)
+        package.close()
+        if isinstance(source, str):
+            package.filename = source
+        else:
+            package._detach()
+        return package
+
+    @classmethod
+    def read_core_properties(cls, source):
+        """
+        Read only the core properties of the package at source (a
+        filename or seekable stream), returning None if it has none.
+        Of the parts, only the package relationships and the core
+        properties are read, however large the package.
+        """
+        select = Selection(rel_types=[CoreProperties.rel_type], max_depth=1)
+        load = cls.from_file if isinstance(source, str) else cls.from_stream
+        package = load(source, select=select)
+        return next(package.get_parts_by_class(CoreProperties), None)
+
+    @classmethod
+    def iter_core_properties(cls, sources, workers=None):
+        """
+        Generate the core properties of each of sources in turn (see
+        read_core_properties), reading them in a pool of that many
+        worker threads if workers is given.
+        """
+        if not workers:
+            yield from map(cls.read_core_properties, sources)
+            return
+        with concurrent.futures.ThreadPoolExecutor(workers) as pool:
+            # bound the sources in flight, which may be many
+            pending = collections.deque()
+            for source in sources:
+                pending.append(pool.submit(cls.read_core_properties, source))
+                if len(pending) >= 2 * workers:
+                    yield pending.popleft().result()
+            while pending:
+                yield pending.popleft().result()
+
+    def _load(self, stream, lazy=False, filename=None, workers=None, select=None):
         zf = ZipFile(stream)
-        self._load_content_types(zf.read('[Content_Types].xml'))
-        rels_path = posixpath.join('_rels', '.rels')
-        self._load_rels(zf.read(rels_path))
-
-        def ropen(item):
-            "read item and recursively open its children"
-            if isinstance(item, Relationships):
-                return
-            if isinstance(item, Part):
-                base, rname = posixpath.split(to_zip_name(item.name))
-                relname = posixpath.join(base, '_rels', '%s.rels' % rname)
-                if relname in zf.namelist():
-                    item._load_rels(zf.read(relname))
-            for rel in item.relationships:
-                pname = posixpath.join(item.base, rel.target)
-                if pname in self:
-                    # This item is already in self.
-                    continue
-                target_path = to_zip_name(pname)
-                data = b"".join(self._get_matching_segments(zf, target_path))
-                new_part = self._load_part(rel.type, pname, data)
-                if new_part:
-                    ropen(new_part)
-
-        ropen(self)
+        # a mapped file remains open, as parts may refer to the mapping
+        retain = lazy or isinstance(stream, mmap.mmap)
+        # Parts loaded from a file keep a reference to their members,
+        #  allowing them to be reread (if evicted) or copied when saved.
+        archive = _Archive(zf, filename) if retain or filename or workers else None
+        index = _ZipIndex(zf, archive)
+        # to load in parallel, defer each part until all are known
+        defer = retain or workers
+        self._load_content_types(index['[Content_Types].xml'].read())
+        member = index[posixpath.join('_rels', '.rels')]
+        self._load_rels(member.read(), member if archive else None)
+        self._open_related(self, index, defer, bool(archive), select)
+        if defer and not lazy:
+            self._load_deferred(workers)
+        if retain:
+            self._archive = archive
+            return
         zf.close()
+        self._archive = archive
+        if not filename:
+            # the stream can't be reopened, so detach the parts from it
+            self._detach()
+
+    def _open_related(self, item, index, defer, track, select=None, depth=0):
+        """
+        Read the relationships of item and recursively open its related
+        parts from index, deferring them if indicated. If track, each
+        part keeps a reference to the member from which it was read.
+        Only the parts selected by select (if given) are opened.
+        """
+        if isinstance(item, Relationships):
+            return
+        if isinstance(item, Part):
+            base, rname = posixpath.split(to_zip_name(item.name))
+            relname = posixpath.join(base, '_rels', '%s.rels' % rname)
+            if relname in index:
+                member = index[relname]
+                item._load_rels(member.read(), member if track else None)
+        for rel in item.relationships:
+            pname = rel.part_name
+            if pname in self:
+                # This item is already in self.
+                continue
+            if select is not None and not select(rel.type, pname, depth + 1):
+                self._partial = True
+                continue
+            member = index[to_zip_name(pname)]
+            if defer:
+                new_part = self._defer_part(rel.type, pname, member)
+            else:
+                origin = member if track else None
+                new_part = self._load_part(rel.type, pname, member.read(), origin)
+            if new_part:
+                self._open_related(new_part, index, defer, track, select, depth + 1)
+
+    def _detach(self):
+        for part in self.parts.values():
+            part._source = None
+        self._archive = None
+
+    def _deferred(self):
+        """
+        Return the parts whose data is yet to be loaded from their source.
+        """
+        return [part for part in self.parts.values() if _is_deferred(part)]
+
+    def _load_deferred(self, workers):
+        """
+        Load the data of the deferred parts, in a pool of worker threads
+        if workers is given (both zlib and lxml release the GIL).
+        """
+        deferred = self._deferred()
+        if not workers:
+            for part in deferred:
+                part._load_source()
+            return
+        with concurrent.futures.ThreadPoolExecutor(workers) as pool:
+            # consume the results to raise any errors
+            for _ in pool.map(Part._load_source, deferred):
+                pass
+
+    def close(self):
+        """
+        Release the file retained by a lazily-loaded package. Parts whose
+        data was not yet loaded can then only be read if the package was
+        loaded from a file that remains unchanged.
+        """
+        if self._archive is not None:
+            self._archive.close()
 
-    def save(self, target=None):
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def save(self, target=None, workers=None, incremental=False, prune=False):
         """
         Save this package to target, which should be a filename or open
         file stream. If target is not supplied, and this package has a
         filename attribute (such as when this package was created from
         an existing file), it will be used.
+
+        Parts that are unchanged since they were loaded from a file are
+        copied from it as stored, without being decompressed and
+        compressed again.
+
+        If workers is given, parts are compressed in parallel by that
+        many threads. The output is the same either way.
+
+        If incremental is True and target is the (unchanged) file from
+        which this package was loaded, only the changed parts, the
+        content types and the central directory are written, after
+        the existing entries; superseded entries are left in place
+        as unused space (see compact). Otherwise, the package is saved
+        in full.
+
+        If prune is True, the parts the package can't reach are removed
+        first (see Package.collect_garbage).
+        """
+        self._check_complete()
+        target = self._resolve_target(target)
+        if prune:
+            self.collect_garbage()
+        if isinstance(target, str):
+            if incremental and self._appendable(target):
+                self._append_file(target, workers)
+            else:
+                for _ in self._iter_save_file(target, workers):
+                    pass
+            self.filename = target
+        else:
+            self._store(target, workers)
+
+    async def asave(self, target=None, executor=None):
+        """
+        Save this package to target, as save does, without blocking the
+        event loop: the package is generated and compressed a chunk at a
+        time by separate calls in executor (the loop's default executor
+        if None). target may be a filename or an asynchronous stream,
+        whose write method may be a coroutine and which may have a drain
+        coroutine (like asyncio.StreamWriter).
         """
+        self._check_complete()
+        target = self._resolve_target(target)
+        if isinstance(target, str):
+            steps = self._iter_save_file(target)
+            while await _advance(steps, executor):
+                pass
+            self.filename = target
+            return
+        sink = _ChunkSink()
+        steps = self._iter_store(sink)
+        while await _advance(steps, executor):
+            for chunk in sink.drain():
+                await _write_async(target, chunk)
+        for chunk in sink.drain():
+            await _write_async(target, chunk)
+
+    def _check_complete(self):
+        if self._partial:
+            msg = (
+                "A package loaded selectively can't be saved; its parts are incomplete"
+            )
+            raise ValueError(msg)
+
+    def _resolve_target(self, target):
         target = target or getattr(self, 'filename', None)
         if target is None:
             msg = (
@@ -80,46 +449,514 @@ class ZipPackage(Package):
                 % self.__class__.__name__
             )
             raise ValueError(msg)
-        if isinstance(target, str):
-            self.filename = target
-            with open(target, 'wb') as stream:
-                self._store(stream)
+        # a path is saved as a filename (never truncated in place)
+        return os.fspath(target) if isinstance(target, os.PathLike) else target
+
+    def _iter_save_file(self, filename, workers=None):
+        """
+        Save the package to filename, yielding after each write.
+        """
+        archive = self._archive
+        # the archive is closed to replace it, so note whether it's open
+        keep_open = archive is not None and archive.is_open
+        if archive is None or not archive.refers_to(filename):
+            with open(filename, 'wb') as stream:
+                yield from self._iter_store(stream, workers)
         else:
-            self._store(target)
+            # parts are still read from the file, so write a new one and
+            #  replace the old one (the file itself, if filename is a
+            #  link, keeping its permissions) once it's complete.
+            path = os.path.realpath(filename)
+            fd, tmp_name = tempfile.mkstemp(dir=os.path.dirname(path))
+            try:
+                with open(fd, 'wb') as stream:
+                    yield from self._iter_store(stream, workers)
+                shutil.copymode(path, tmp_name)
+                archive.close()
+                os.replace(tmp_name, path)
+            except BaseException:
+                os.remove(tmp_name)
+                raise
+        self._anchor(filename, keep_open=keep_open)
+
+    def _appendable(self, filename):
+        archive = self._archive
+        return (
+            archive is not None and archive.refers_to(filename) and archive.is_available
+        )
+
+    def _append_file(self, filename, workers=None):
+        """
+        Append the changed parts to filename, the file from which this
+        package was loaded, and drop the entries they supersede (and
+        any others that are no longer parts) from its central directory.
+        The entry of a part that fails to generate content is kept.
+        """
+        changed = [part for part in self.parts.values() if part.dirty]
+        # the file is about to change, so read what's still to be read
+        #  from it (such as for parts generated by a custom dump)
+        for part in changed:
+            if part._source is not None and '_data' not in vars(part):
+                part._load_source()
+        keep_open = self._archive.is_open
+        self._archive.close()
+        names = set(map(to_zip_name, self.parts))
+        rewritten = {to_zip_name(part.name) for part in changed}
+        rewritten.add('[Content_Types].xml')
+        zf = _ZipPackageZipFile(filename, mode='a', compression=ZIP_DEFLATED)
+        with zf:
+            members = _ZipIndex(zf).members
+            superseded = {
+                name: infos for name, infos in members.items() if name in rewritten
+            }
+            for infos in superseded.values():
+                zf.hide_members(infos)
+            zf.write_part('[Content_Types].xml', self.content_types.dump())
+            if workers:
+                steps = self._store_parallel(zf, changed, None, workers)
+            else:
+                steps = (
+                    step
+                    for part in changed
+                    for step in self._store_part(zf, part, None)
+                )
+            for _ in steps:
+                pass
+            for name, infos in superseded.items():
+                if name in zf.NameToInfo:
+                    zf.remove_members(infos)
+                else:
+                    zf.restore_members(infos)
+            for name, infos in members.items():
+                if name not in names and name not in superseded:
+                    zf.remove_members(infos)
+        self._anchor(filename, keep_open=keep_open)
+
+    def compact(self, workers=None):
+        """
+        Rewrite the file of this package in full, reclaiming the space
+        left by superseded entries after incremental saves. Unchanged
+        parts are copied as stored. See save for workers.
+        """
+        self.save(workers=workers)
+
+    def _anchor(self, filename, keep_open=False):
+        """
+        After saving to filename, make it the source of the unchanged
+        parts (whose members in any previous source no longer apply) and
+        of those just written from their data, which are then unchanged
+        too (so a subsequent incremental save needn't write them again).
+        """
+        zf = ZipFile(filename)
+        archive = _Archive(zf, filename)
+        index = _ZipIndex(zf, archive)
+        for part in self.parts.values():
+            member = index[to_zip_name(part.name)]
+            previous, part._source = part._source, member
+            if not member.infos or part.dirty:
+                # the part wasn't saved, or is generated when saved
+                part._source = previous
+        if not keep_open:
+            zf.close()
+        self._archive = archive
 
-    def as_stream(self):
+    def as_stream(self, workers=None):
         """
-        Return a zipped package as a readable stream
+        Return a zipped package as a readable stream. See save for
+        workers.
         """
         stream = io.BytesIO()
-        self._store(stream)
+        self._store(stream, workers)
         stream.seek(0)
         return stream
 
-    def _store(self, stream):
-        zf = _ZipPackageZipFile(stream, mode='w', compression=ZIP_DEFLATED)
-        zf.write_part('[Content_Types].xml', self.content_types.dump())
-        zf.write_part('_rels/.rels', self.relationships.dump())
-        for name in self.parts:
-            if name == '/_rels/.rels':
-                continue
-            part = self[name]
-            try:
-                zf.write_part(to_zip_name(name), part.dump())
-            except BaseException:
-                # silently ignore any part that fails to generate any
-                #  content.
-                pass
+    def as_chunks(self, workers=None):
+        """
+        Generate the zipped package as a sequence of bytes chunks, as
+        it's written, without assembling the archive in memory (such as
+        for the body of an HTTP response). Because the output isn't
+        seekable, each member is followed by a data descriptor. See
+        save for workers.
+        """
+        sink = _ChunkSink()
+        for _ in self._iter_store(sink, workers):
+            yield from sink.drain()
+        yield from sink.drain()
+
+    def _store(self, stream, workers=None):
+        for _ in self._iter_store(stream, workers):
+            pass
+
+    def _iter_store(self, stream, workers=None):
+        """
+        Write the package to stream, streaming each part in chunks,
+        yielding after each write.
+        """
+        self._check_complete()
+        date_time = time.gmtime(source_date_epoch()) if self.reproducible else None
+        zf = _ZipPackageZipFile(
+            stream, mode='w', compression=ZIP_DEFLATED, date_time=date_time
+        )
+        try:
+            zf.write_part('[Content_Types].xml', self.content_types.dump())
+            yield
+            items = self.parts.items()
+            if self.reproducible:
+                items = sorted(items, key=operator.itemgetter(0))
+            parts = [self.relationships]
+            parts.extend(part for name, part in items if name != '/_rels/.rels')
+            with self._open_source() as source:
+                if workers:
+                    yield from self._store_parallel(zf, parts, source, workers)
+                else:
+                    for part in parts:
+                        yield from self._store_part(zf, part, source)
+        except BaseException:
+            zf.abandon()
+            raise
         zf.close()
 
-    def _get_matching_segments(self, zf, name):
+    def _copyable(self, part, source):
+        """
+        Can part be copied as stored from source?
+        """
+        return (
+            source is not None
+            and not part.dirty
+            and part._source.copyable_from(self._archive)
+        )
+
+    def _store_part(self, zf, part, source):
+        name = to_zip_name(part.name)
+        if self._copyable(part, source):
+            yield from zf.copy_member(name, part._source.infos[0], source)
+            return
+        if _is_deferred(part):
+            # read the data first, so that a source that's no longer
+            #  available raises, rather than the part being left out
+            #  below as failing to generate content
+            part._load_source()
+        try:
+            chunks = part.iter_dump()
+            first = next(chunks, b'')
+        except BaseException:
+            # silently ignore any part that fails to generate any
+            #  content.
+            return
+        compression = self._compression_for(part, first)
+        with zf.open_part(name, _known_size(part), compression) as dest:
+            dest.write(first)
+            yield
+            for chunk in chunks:
+                dest.write(chunk)
+                yield
+
+    def _store_parallel(self, zf, parts, source, workers):
         """
-        Return a generator yielding each of the segments who's names
-        match name.
+        Like _store_part for each of parts, but compress the parts in a
+        pool of worker threads (zlib releases the GIL), writing them in
+        order as they're ready. Parts copied as stored or with streamed
+        data are written in turn, without being held in memory. The
+        output is the same as if the parts were stored serially.
         """
-        for n in zf.namelist():
-            if n.startswith(name):
-                yield zf.read(n)
+        pending = collections.deque()
+
+        def write_next():
+            part, future = pending.popleft()
+            if future is None:
+                return self._store_part(zf, part, source)
+            return zf.write_compressed(future.result())
+
+        with concurrent.futures.ThreadPoolExecutor(workers) as pool:
+            for part in parts:
+                future = None
+                # parts copied or streamed are written in turn, rather than
+                #  held in memory
+                if not self._copyable(part, source) and not part._streams_data():
+                    info = zf._part_info(to_zip_name(part.name))
+                    choose = functools.partial(self._compression_for, part)
+                    future = pool.submit(_Compressed.from_part, part, info, choose)
+                pending.append((part, future))
+                # bound the compressed content held in memory
+                if len(pending) > 2 * workers:
+                    yield from write_next()
+            while pending:
+                yield from write_next()
+
+    def _compression_for(self, part, sample):
+        """
+        Apply the compression policy to part, given the first chunk of
+        its content.
+        """
+        content_type = getattr(self.content_types.find_for(part.name), 'name', None)
+        return self.compression(part.name, content_type, _known_size(part), sample)
+
+    def open_part(self, name, mode='rb'):
+        """
+        Open the named part as a binary file. See Package.open_part.
+
+        The content of a part not yet loaded from the zip file (as in a
+        lazily-loaded package) is streamed from its member (or pieces),
+        decompressed as it's read. Seeking backward in a compressed
+        member reads it again from the start.
+        """
+        part = self[name]
+        source = part._source
+        streamable = (
+            mode == 'rb'
+            and '_data' not in vars(part)
+            and isinstance(source, _Member)
+            and isinstance(source.reader, _Archive)
+        )
+        if streamable:
+            return source.open()
+        return super().open_part(name, mode)
+
+    def _checksum(self, part):
+        """
+        Take the size and CRC-32 of a part that's unchanged from its
+        zip file from the zip file's directory, without reading it.
+        """
+        source = part._source
+        if not part.dirty and isinstance(source, _Member) and len(source.infos) == 1:
+            (info,) = source.infos
+            return info.file_size, info.CRC
+        return super()._checksum(part)
+
+    @contextlib.contextmanager
+    def _open_source(self):
+        """
+        Provide the zip file from which the package was loaded, if it's
+        still available, else None.
+        """
+        if self._archive is None:
+            yield None
+            return
+        with self._archive.opened() as zf:
+            yield zf
+
+
+class _ZipIndex:
+    """
+    An index of the members of a zip file by name, built in one pass
+    over its central directory. The pieces of an interleaved part (OPC
+    9.1.3) are grouped in order under the name of the part.
+
+    Members are read through archive, if supplied.
+    """
+
+    piece_pattern = re.compile(
+        r'(?P<name>.+)/\[(?P<number>\d+)\](?P<last>\.last)?\.piece$',
+        re.IGNORECASE,
+    )
+
+    def __init__(self, zf, archive=None):
+        self.reader = archive or zf
+        self.members = {}
+        pieces = collections.defaultdict(list)
+        for info in zf.infolist():
+            match = self.piece_pattern.match(info.filename)
+            if match:
+                pieces[match['name']].append((int(match['number']), info))
+            else:
+                self.members[info.filename] = [info]
+        for name, numbered in pieces.items():
+            numbered.sort(key=operator.itemgetter(0))
+            self.members.setdefault(name, [info for number, info in numbered])
+
+    def __contains__(self, name):
+        return name in self.members
+
+    def __getitem__(self, name):
+        """
+        Return the member for name (which is empty if there's no such
+        member).
+        """
+        return _Member(self.reader, self.members.get(name, []))
+
+
+class _Archive:
+    """
+    The zip file from which a package was loaded. While it's open (as
+    for a lazily-loaded package), members are read from it directly.
+    Otherwise, a file on disk is reopened to read members, provided it
+    hasn't changed since it was loaded.
+    """
+
+    def __init__(self, zf, filename=None):
+        self.zf = zf
+        self.filename = filename
+        self.signature = filename and self._signature(filename)
+        self.mapping = zf.fp if isinstance(zf.fp, mmap.mmap) else None
+
+    @staticmethod
+    def _signature(filename):
+        stat = os.stat(filename)
+        return stat.st_size, stat.st_mtime_ns
+
+    @property
+    def is_open(self):
+        return self.zf.fp is not None
+
+    @property
+    def is_available(self):
+        if self.is_open:
+            return True
+        try:
+            return self.signature == self._signature(self.filename)
+        except (TypeError, OSError):
+            return False
+
+    def refers_to(self, filename):
+        try:
+            return os.path.samefile(self.filename, filename)
+        except (TypeError, OSError):
+            return False
+
+    @contextlib.contextmanager
+    def opened(self):
+        """
+        Provide the open zip file, or None if it's no longer available.
+        """
+        if self.is_open:
+            yield self.zf
+        elif self.is_available:
+            with ZipFile(self.filename) as zf:
+                yield zf
+        else:
+            yield None
+
+    def read(self, info):
+        with self.opened() as zf:
+            if zf is None:
+                raise ValueError(f"{self.filename or 'Archive'} is no longer available")
+            if zf is self.zf and self.mapping is not None:
+                return _read_mapped(zf, info)
+            return _read_member(zf, info)
+
+    def acquire(self):
+        """
+        Return a zip file from which to open members, and whether it
+        was opened for the purpose (and should be closed by the caller).
+        """
+        # members can't be opened from a mapping (it isn't seekable)
+        if self.is_open and self.mapping is None:
+            return self.zf, False
+        if not self.is_available or self.filename is None:
+            raise ValueError(f"{self.filename or 'Archive'} is no longer available")
+        return ZipFile(self.filename), True
+
+    def close(self):
+        self.zf.close()
+        if self.mapping is None:
+            return
+        with contextlib.suppress(BufferError):
+            # unless parts still refer to it, in which case it's closed
+            #  once they're released.
+            self.mapping.close()
+
+
+class _Member:
+    """
+    The segments of a part in a zip file, read on demand.
+    """
+
+    def __init__(self, reader, infos):
+        self.reader = reader
+        self.infos = infos
+
+    def read(self):
+        if len(self.infos) == 1:
+            return self.reader.read(self.infos[0])
+        return b"".join(map(self.reader.read, self.infos))
+
+    def open(self):
+        """
+        Return a seekable file streaming the content of this member.
+        """
+        zf, owned = self.reader.acquire()
+        return io.BufferedReader(_MemberReader(zf, self.infos, owned))
+
+    def copyable_from(self, archive):
+        """
+        Can this member be copied as stored from archive?
+        """
+        return (
+            self.reader is archive
+            and len(self.infos) == 1
+            and not self.infos[0].flag_bits & _MASK_ENCRYPTED
+        )
+
+
+class _MemberReader(io.RawIOBase):
+    """
+    A seekable file for the content of the pieces (infos) of a member in
+    zf, each opened in turn as it's reached. Closing it closes zf if
+    owned.
+    """
+
+    def __init__(self, zf, infos, owned=False):
+        self.zf = zf
+        self.infos = infos
+        self.owned = owned
+        sizes = (info.file_size for info in infos)
+        self.starts = list(itertools.accumulate(sizes, initial=0))
+        self.position = 0
+        self.piece = None
+        self.file = None
+
+    @property
+    def size(self):
+        return self.starts[-1]
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def tell(self):
+        return self.position
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        origin = {io.SEEK_SET: 0, io.SEEK_CUR: self.position, io.SEEK_END: self.size}
+        position = origin[whence] + offset
+        if position < 0:
+            raise ValueError(f"negative seek position {position}")
+        self.position = position
+        return position
+
+    def readinto(self, buffer):
+        if self.position >= self.size:
+            return 0
+        piece = bisect.bisect_right(self.starts, self.position) - 1
+        file = self._open(piece)
+        file.seek(self.position - self.starts[piece])
+        data = file.read(min(len(buffer), self.starts[piece + 1] - self.position))
+        if not data:
+            raise BadZipFile(f"Truncated member {self.infos[piece].filename}")
+        buffer[: len(data)] = data
+        self.position += len(data)
+        return len(data)
+
+    def _open(self, piece):
+        if piece != self.piece:
+            self._close_piece()
+            self.file = self.zf.open(self.infos[piece])
+            self.piece = piece
+        return self.file
+
+    def _close_piece(self):
+        if self.file is not None:
+            self.file.close()
+        self.piece = self.file = None
+
+    def close(self):
+        if not self.closed:
+            self._close_piece()
+            if self.owned:
+                self.zf.close()
+        super().close()
 
 
 class _ZipPackageZipFile(ZipFile):
@@ -128,19 +965,323 @@ class _ZipPackageZipFile(ZipFile):
     usage of a ZipFile for ZipPackages.
     """
 
-    def __init__(self, *args, **kwargs):
+    def __init__(self, *args, date_time=None, **kwargs):
         ZipFile.__init__(self, *args, **kwargs)
         # each piece of content will be created with the same date_time
-        # attribute (set to now)
-        now = time.localtime(time.time())
-        self.zip_info_factory = functools.partial(ZipInfo, date_time=now)
+        # attribute (set to now, unless supplied)
+        date_time = date_time or time.localtime(time.time())
+        self.zip_info_factory = functools.partial(ZipInfo, date_time=date_time)
 
-    def write_part(self, name, content):
+    def _part_info(self, name, compression=(ZIP_DEFLATED, None)):
         USER_READ_WRITE = 25165824
         SYSUNIX = 3
         info = self.zip_info_factory(name)
         info.create_system = SYSUNIX
         info.flag_bits = 8
         info.external_attr = USER_READ_WRITE
-        info.compress_type = ZIP_DEFLATED
-        self.writestr(info, content)
+        info.compress_type, info._compresslevel = compression
+        return info
+
+    def abandon(self):
+        """
+        Release the file of an archive that failed to be written in
+        full, without writing its central directory.
+        """
+        fp, self.fp = self.fp, None
+        self._fpclose(fp)
+
+    def remove_members(self, infos):
+        """
+        Drop the entries for infos from the central directory. Their
+        content remains in the file as unused space.
+        """
+        for info in infos:
+            self.filelist.remove(info)
+            if self.NameToInfo.get(info.filename) is info:
+                del self.NameToInfo[info.filename]
+
+    def hide_members(self, infos):
+        """
+        Remove the names of infos from the index of names, so entries of
+        the same names can be written, leaving the entries in place
+        until removed (or restored).
+        """
+        for info in infos:
+            self.NameToInfo.pop(info.filename, None)
+
+    def restore_members(self, infos):
+        for info in infos:
+            self.NameToInfo[info.filename] = info
+
+    def write_part(self, name, content):
+        self.writestr(self._part_info(name), content)
+
+    def open_part(self, name, file_size=None, compression=(ZIP_DEFLATED, None)):
+        """
+        Return a writable file object for the content of the named part,
+        compressed as indicated by (compress_type, compresslevel). If
+        file_size (the size of the content) isn't known up front, allow
+        for it to exceed the limits of a plain zip entry.
+        """
+        info = self._part_info(name, compression)
+        info.file_size = file_size or 0
+        return self.open(info, mode='w', force_zip64=file_size is None)
+
+    def write_compressed(self, compressed):
+        """
+        Write the entry for a part compressed by _Compressed.from_part
+        (which may be None if the part failed to generate content).
+        """
+        if compressed is None:
+            return iter(())
+        return self._write_compressed(
+            compressed.info, compressed.chunks, compressed.force_zip64
+        )
+
+    def copy_member(self, name, source_info, source, chunk_size=2**20):
+        """
+        Copy the member described by source_info from the zip file
+        source as the named part, without decompressing it, yielding
+        after each chunk written.
+        """
+        info = self._part_info(name)
+        info.compress_type = source_info.compress_type
+        info.CRC = source_info.CRC
+        info.file_size = source_info.file_size
+        info.compress_size = source_info.compress_size
+        yield from self._write_compressed(
+            info, _read_raw(source, source_info, chunk_size)
+        )
+
+    def _write_compressed(self, info, chunks, force_zip64=False):
+        """
+        Write an entry for info (with its sizes and CRC populated) from
+        chunks of already-compressed content, as ZipFile.open would.
+        """
+        zip64 = (
+            force_zip64
+            or info.file_size * 1.05 > ZIP64_LIMIT
+            or info.compress_size > ZIP64_LIMIT
+        )
+        info.flag_bits = 0 if self._seekable else _MASK_USE_DATA_DESCRIPTOR
+        if info.compress_type == ZIP_LZMA:
+            # as ZipFile does, mark the stream as ending with a marker
+            info.flag_bits |= _MASK_COMPRESS_OPTION_1
+        with self._lock:
+            if self._seekable:
+                self.fp.seek(self.start_dir)
+            info.header_offset = self.fp.tell()
+            self._writecheck(info)
+            self._didModify = True
+            self.fp.write(info.FileHeader(zip64))
+            # as for ZipFile.open, bar other writes until the entry is
+            #  complete, without holding the lock across yields.
+            self._writing = True
+        try:
+            for chunk in chunks:
+                with self._lock:
+                    self.fp.write(chunk)
+                yield
+        finally:
+            self._writing = False
+        with self._lock:
+            if info.flag_bits & _MASK_USE_DATA_DESCRIPTOR:
+                fmt = '<LLQQ' if zip64 else '<LLLL'
+                self.fp.write(
+                    struct.pack(
+                        fmt,
+                        _DD_SIGNATURE,
+                        info.CRC,
+                        info.compress_size,
+                        info.file_size,
+                    )
+                )
+            self.start_dir = self.fp.tell()
+            self.filelist.append(info)
+            self.NameToInfo[info.filename] = info
+
+
+class _Compressed:
+    """
+    The compressed content of a part, ready to be written to a zip file.
+    """
+
+    def __init__(self, info, chunks, force_zip64):
+        self.info = info
+        self.chunks = chunks
+        self.force_zip64 = force_zip64
+
+    @classmethod
+    def from_part(cls, part, info, choose=None):
+        """
+        Compress the content of part as ZipFile would for info, or
+        return None if the part fails to generate any content. If
+        supplied, choose is called with the first chunk of the content
+        to set the compression of info, as (compress_type, compresslevel).
+        """
+        if _is_deferred(part):
+            # as for _store_part, a source that's no longer available raises
+            part._load_source()
+        try:
+            chunks = part.iter_dump()
+            first = next(chunks, b'')
+        except BaseException:
+            # as for _store_part, skip a part that fails to generate
+            #  any content
+            return None
+        if choose is not None:
+            info.compress_type, info._compresslevel = choose(first)
+        compressor = _get_compressor(info)
+        compressed = []
+        crc = file_size = 0
+        for chunk in itertools.chain([first], chunks):
+            crc = zlib.crc32(chunk, crc)
+            file_size += memoryview(chunk).nbytes
+            compressed.append(compressor.compress(chunk) if compressor else chunk)
+        if compressor:
+            compressed.append(compressor.flush())
+        info.CRC = crc
+        info.file_size = file_size
+        info.compress_size = sum(map(len, compressed))
+        # as for open_part, allow for content of a size not known up front
+        return cls(info, compressed, _known_size(part) is None)
+
+
+def _is_deferred(part):
+    """
+    Is the data of part yet to be loaded from its source?
+    """
+    return (
+        not isinstance(part, Relationships)
+        and part._source is not None
+        and '_data' not in vars(part)
+    )
+
+
+def _known_size(part):
+    """
+    Return the size of the content of part if it's known before the
+    content has been generated in full (that is, unless it's streamed
+    or generated by a custom dump), else None.
+    """
+    if type(part).dump is not Part.dump:
+        return None
+    content = vars(part).get('_dumped', vars(part).get('_data'))
+    if isinstance(content, (bytes, memoryview)):
+        return memoryview(content).nbytes
+    return None
+
+
+def _get_compressor(info):
+    """
+    Return the compressor ZipFile would use for info (or None if its
+    content is stored).
+    """
+    return zipfile._get_compressor(info.compress_type, info._compresslevel)
+
+
+def _read_member(zf, info):
+    """
+    Read the member for info from zf, like ZipFile.read, but safely from
+    multiple threads and (for the common compression methods) only
+    holding the lock on the file while reading the stored content, so
+    members can be decompressed in parallel.
+    """
+    supported = info.compress_type in (ZIP_STORED, ZIP_DEFLATED)
+    if not supported or info.flag_bits & _MASK_ENCRYPTED:
+        with zf._lock:
+            return zf.read(info)
+    data = b''.join(_read_raw(zf, info, chunk_size=info.compress_size or 1))
+    if info.compress_type == ZIP_DEFLATED:
+        data = zlib.decompress(data, -15)
+    if zlib.crc32(data) != info.CRC:
+        raise BadZipFile(f"Bad CRC-32 for file {info.filename!r}")
+    return data
+
+
+def _read_mapped(zf, info):
+    """
+    Read the member for info from the memory-mapped zip file, returning
+    a view of the mapping for a stored member.
+    """
+    supported = info.compress_type in (ZIP_STORED, ZIP_DEFLATED)
+    if not supported or info.flag_bits & _MASK_ENCRYPTED:
+        return _read_member(zf, info)
+    mapping = zf.fp
+    name_length, extra_length = struct.unpack_from(
+        '<HH', mapping, info.header_offset + _FILE_HEADER_SIZE - 4
+    )
+    start = info.header_offset + _FILE_HEADER_SIZE + name_length + extra_length
+    view = memoryview(mapping)[start : start + info.compress_size]
+    if info.compress_type == ZIP_STORED:
+        return view
+    data = zlib.decompress(view, -15)
+    if zlib.crc32(data) != info.CRC:
+        raise BadZipFile(f"Bad CRC-32 for file {info.filename!r}")
+    return data
+
+
+def _read_raw(zf, info, chunk_size):
+    """
+    Generate the stored (compressed) content of the member for info
+    from zf in chunks.
+    """
+    fp = zf.fp
+    remaining = info.compress_size
+    # the lock is held only while reading, not across yields (when
+    #  the consumer might resume in another thread).
+    with zf._lock:
+        fp.seek(info.header_offset)
+        header = fp.read(_FILE_HEADER_SIZE)
+        name_length, extra_length = struct.unpack('<HH', header[-4:])
+        position = fp.tell() + name_length + extra_length
+    while remaining:
+        with zf._lock:
+            fp.seek(position)
+            chunk = fp.read(min(chunk_size, remaining))
+            position = fp.tell()
+        if not chunk:
+            raise BadZipFile(f"Truncated member {info.filename}")
+        remaining -= len(chunk)
+        yield chunk
+
+
+_done = object()
+
+
+async def _advance(steps, executor):
+    """
+    Run the next step of the generator steps in executor, returning
+    False once it's exhausted.
+    """
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(executor, next, steps, _done) is not _done
+
+
+async def _write_async(stream, data):
+    result = stream.write(data)
+    if inspect.isawaitable(result):
+        await result
+    drain = getattr(stream, 'drain', None)
+    if drain is not None:
+        await drain()
+
+
+class _ChunkSink:
+    """
+    An unseekable stream that accumulates written chunks until drained.
+    """
+
+    def __init__(self):
+        self.chunks = []
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def drain(self):
+        chunks, self.chunks = self.chunks, []
+        return chunks
@@ -1,4 +1,7 @@
+import gc
+import io
 import re
+import weakref
 
 import pytest
 
@@ -161,3 +164,287 @@ class TestRelationship:
     def test_id_generation(self):
         candidate = Relationship._generate_id()
         assert re.match('d[0-9a-f]{8,}', candidate)
+
+
+class TestPartNameValidation:
+    def test_derived_name_rejected(self):
+        pack = Package()
+        pack['/foo/bar.xml'] = Part(pack, '/foo/bar.xml')
+        with pytest.raises(ValueError, match='is a derivative of'):
+            pack['/foo'] = Part(pack, '/foo')
+
+    def test_unrelated_names_accepted(self):
+        pack = Package()
+        for name in '/foo/b', '/foo/a', '/fop', '/fo/x':
+            pack[name] = Part(pack, name)
+        assert '/fo/x' in pack
+
+    def test_deleted_name_released(self):
+        pack = Package()
+        pack['/foo/bar.xml'] = Part(pack, '/foo/bar.xml')
+        del pack['/foo/bar.xml']
+        del pack['/foo/_rels/bar.xml.rels']
+        pack['/foo'] = Part(pack, '/foo')
+
+
+class TestContentTypesIndex:
+    def test_override_preferred(self):
+        cts = ContentTypes([ContentType.Default('application/xml', 'xml')])
+        cts.add(ContentType.Override('text/pmx+xml', '/Foo/Bar.xml'))
+        assert cts.find_for('/foo/bar.xml').name == 'text/pmx+xml'
+        assert cts.find_for('/foo/baz.xml').name == 'application/xml'
+
+    def test_removal(self):
+        cts = ContentTypes()
+        override = ContentType.Override('text/pmx+xml', '/foo/bar.xml')
+        cts |= {override, ContentType.Default('application/xml', 'xml')}
+        cts.remove(override)
+        assert cts.find_for('/foo/bar.xml').name == 'application/xml'
+        cts.clear()
+        assert cts.find_for('/foo/bar.xml') is None
+
+    def test_removal_falls_back_to_same_key(self):
+        first = ContentType.Default('application/xml', 'xml')
+        second = ContentType.Default('text/xml', 'XML')
+        cts = ContentTypes([first, second])
+        cts.discard(second)
+        assert cts.find_for('/foo.xml') is first
+
+    def test_removal_keeps_latest(self):
+        items = [
+            ContentType.Override(f'text/v{n}+xml', key)
+            for n, key in enumerate(['/a.xml', '/A.xml', '/a.XML'])
+        ]
+        cts = ContentTypes(items)
+        assert cts.find_for('/a.xml') is items[2]
+        cts.discard(items[1])
+        assert cts.find_for('/a.xml') is items[2]
+        cts.discard(items[2])
+        assert cts.find_for('/a.xml') is items[0]
+        cts.discard(items[0])
+        assert cts.find_for('/a.xml') is None
+
+    def test_compatibility_maps(self):
+        cts = ContentTypes.load(
+            ContentTypes([
+                ContentType.Default('application/xml', 'xml'),
+                ContentType.Override('text/pmx+xml', '/foo/bar.xml'),
+            ]).dump()
+        )
+        assert list(cts.defaults) == ['xml']
+        assert list(cts.overrides) == ['/foo/bar.xml']
+        assert cts.find_for('/FOO/BAR.XML').name == 'text/pmx+xml'
+
+
+class TestRelationshipsLoad:
+    def dumped(self, count):
+        pack = Package()
+        for number in range(count):
+            rel = Relationship(
+                pack, f'part{number}.xml', 'http://pmx/test', f'r{number}'
+            )
+            pack.relationships.add(rel)
+        return pack.relationships.dump()
+
+    def test_load_bytes(self):
+        pack = Package()
+        rels = Relationships(pack, pack)
+        rels.load(pack, self.dumped(3))
+        assert sorted(rel.id for rel in rels) == ['r0', 'r1', 'r2']
+        assert {rel.target for rel in rels.types['http://pmx/test']} == {
+            'part0.xml',
+            'part1.xml',
+            'part2.xml',
+        }
+
+    def test_load_stream(self):
+        pack = Package()
+        rels = Relationships(pack, pack)
+        rels.load(pack, io.BytesIO(self.dumped(1000)))
+        assert len(rels.ids) == 1000
+        rel = next(iter(rels.types['http://pmx/test']))
+        assert rel.source is pack
+        assert rel.mode == 'Internal'
+
+    def test_duplicate_id_rejected(self):
+        pack = Package()
+        data = self.dumped(1).replace(b'</Relationships>', b'') + (
+            b'<Relationship Id="r0" Type="t" Target="x.xml"/></Relationships>'
+        )
+        with pytest.raises(ValueError):
+            Relationships(pack, pack).load(pack, data)
+
+
+class TestRelationshipsStore:
+    def test_materialized_in_order(self):
+        pack = Package()
+        rels = pack.relationships
+        for name in 'b.xml', 'a.xml', 'c.xml':
+            rels.add(Relationship(pack, name, 'http://pmx/test', name[0]))
+        assert [rel.target for rel in rels] == ['b.xml', 'a.xml', 'c.xml']
+        assert rels['a'] == Relationship(pack, 'a.xml', 'http://pmx/test', 'a')
+        assert rels['a'].source is pack
+        assert 'a' in rels.ids
+        with pytest.raises(KeyError):
+            rels['d']
+
+    def test_indexes(self):
+        pack = Package()
+        rels = pack.relationships
+        rels.add(Relationship(pack, 'a.xml', 'http://pmx/one', 'r1'))
+        rels.add(Relationship(pack, 'b.xml', 'http://pmx/two', 'r2'))
+        rels.add(Relationship(pack, 'a.xml', 'http://pmx/two', 'r3'))
+        assert [rel.id for rel in rels.of_type('http://pmx/two')] == ['r2', 'r3']
+        assert [rel.id for rel in rels.to_target('a.xml')] == ['r1', 'r3']
+        assert rels.of_type('http://pmx/three') == []
+        assert set(rels.types) == {'http://pmx/one', 'http://pmx/two'}
+        assert len(rels.children) == 3
+
+    def test_duplicate_id_rejected(self):
+        pack = Package()
+        pack.relationships.add(Relationship(pack, 'a.xml', 'http://pmx/test', 'r1'))
+        with pytest.raises(ValueError):
+            pack.relationships.add(Relationship(pack, 'b.xml', 'http://pmx/t', 'r1'))
+
+    def test_reproducible_ids(self):
+        pack = Package()
+        pack.reproducible = True
+        pack.relationships.add(Relationship(pack, 'a.xml', 'http://pmx/test'))
+        pack.relate(SamplePart(pack, '/b.xml'))
+        part = SamplePart(pack, '/c/d.xml')
+        part.relationships.add(Relationship(part, 'e.xml', 'http://pmx/test'))
+        assert list(pack.relationships.ids) == ['rId1', 'rId2']
+        assert list(part.relationships.ids) == ['rId1']
+
+    def test_slots(self):
+        assert not hasattr(Relationship(Package(), 'a.xml', 'http://pmx/t'), '__dict__')
+        assert not hasattr(ContentType.Default('application/xml', 'xml'), '__dict__')
+
+
+class TestRelationshipGraph:
+    image = 'http://pmx/image'
+
+    def build(self):
+        pack = Package()
+        doc = SamplePart(pack, '/word/doc.xml')
+        pack.relate(doc)
+        pack.add(doc)
+        for name in '/media/a.png', '/media/b.png':
+            image = SamplePart(pack, name, rel_type=self.image)
+            pack.add(image)
+        doc.relationships.add(Relationship(doc, '../media/a.png', self.image, 'r1'))
+        doc.relationships.add(
+            Relationship(doc, 'http://x/', self.image, 'r2', 'External')
+        )
+        return pack
+
+    def test_edges(self):
+        pack = self.build()
+        graph = pack.graph
+        assert graph.targets('/') == ['/word/doc.xml']
+        assert graph.targets('/word/doc.xml', self.image) == ['/media/a.png']
+        assert graph.sources('/media/a.png') == ['/word/doc.xml']
+        assert graph.sources('/media/a.png', SamplePart.rel_type) == []
+        assert pack['/word/doc.xml'].related(self.image) == [pack['/media/a.png']]
+
+    def test_reachable_and_orphans(self):
+        pack = self.build()
+        assert pack.graph.reachable('/') == {'/word/doc.xml', '/media/a.png'}
+        assert pack.graph.reachable('/', reltype=self.image) == set()
+        assert pack.orphans() == ['/media/b.png']
+
+    def test_removed_part(self):
+        pack = self.build()
+        doc = pack['/word/doc.xml']
+        del pack['/word/doc.xml']
+        assert pack.graph.sources('/media/a.png') == []
+        assert set(pack.orphans()) == {'/media/a.png', '/media/b.png'}
+        pack['/word/doc.xml'] = doc
+        assert pack.graph.sources('/media/a.png') == ['/word/doc.xml']
+        assert pack.orphans() == ['/media/b.png']
+
+    def test_linked_into_storing_package(self):
+        pack, other = self.build(), Package()
+        part = SamplePart(pack, '/media/other.xml')
+        part.relate(pack['/media/a.png'])
+        assert pack.graph.sources('/media/a.png') == ['/word/doc.xml']
+        other.add(part)
+        assert other.graph.targets('/media/other.xml') == ['/media/a.png']
+        assert pack.graph.targets('/media/other.xml') == []
+
+    def test_discarded_package_released(self):
+        pack = self.build()
+        part = pack['/media/a.png']
+        for _ in range(3):
+            other = Package()
+            other.add(part)
+            graph = weakref.ref(other.graph)
+            del other
+            gc.collect()
+            assert graph() is None
+        part.relate(pack['/media/b.png'])
+        assert pack.graph.sources('/media/b.png') == ['/media/a.png']
+
+    def test_unstored_relationships_unlinked(self):
+        pack = self.build()
+        rels = Relationships(pack, pack)
+        rels.load(pack, pack.relationships.dump())
+        assert pack.graph.sources('/word/doc.xml') == ['/']
+        loose = SamplePart(pack, '/media/loose.xml')
+        loose.relate(pack['/media/b.png'])
+        assert loose.related(self.image) == [pack['/media/b.png']]
+        assert pack.graph.sources('/media/b.png') == []
+        assert '/media/b.png' in pack.collect_garbage()
+
+    def test_collect_garbage(self):
+        pack = self.build()
+        orphan = SamplePart(pack, '/media/c.xml')
+        orphan.relate(pack['/media/a.png'])
+        pack.add(orphan)
+        assert '/media/_rels/c.xml.rels' in pack
+        assert pack.collect_garbage() == [
+            '/media/b.png',
+            '/media/_rels/b.png.rels',
+            '/media/c.xml',
+            '/media/_rels/c.xml.rels',
+        ]
+        assert '/media/b.png' not in pack
+        assert pack.content_types.find_for('/media/b.png') is None
+        assert pack.content_types.find_for('/media/a.png') is not None
+        assert pack.collect_garbage() == []
+
+
+class TestDeduplicate:
+    image = 'http://pmx/image'
+
+    def build(self):
+        pack = Package()
+        doc = SamplePart(pack, '/word/doc.xml', data=b'<doc/>')
+        pack.relate(doc)
+        pack.add(doc)
+        content = {'a': b'logo', 'b': b'logo', 'c': b'other', 'd': iter([b'logo'])}
+        for id, data in content.items():
+            name = f'/media/{id}.png'
+            pack.add(SamplePart(pack, name, rel_type=self.image, data=data))
+            doc.relationships.add(
+                Relationship(doc, f'../media/{id}.png', self.image, id)
+            )
+        pack.relationships.add(Relationship(pack, '/media/b.png', self.image, 'top'))
+        return pack
+
+    def test_find_duplicates(self):
+        assert self.build().find_duplicates() == [['/media/a.png', '/media/b.png']]
+
+    def test_deduplicate(self):
+        pack = self.build()
+        assert pack.deduplicate() == {'/media/b.png': '/media/a.png'}
+        assert '/media/b.png' not in pack
+        assert '/media/_rels/b.png.rels' not in pack
+        assert pack.content_types.find_for('/media/b.png') is None
+        doc = pack['/word/doc.xml']
+        assert doc.relationships['b'].target == '../media/a.png'
+        assert pack.relationships['top'].target == '/media/a.png'
+        assert doc.related(self.image).count(pack['/media/a.png']) == 2
+        assert set(pack.graph.sources('/media/a.png')) == {'/', '/word/doc.xml'}
+        assert pack.graph.sources('/media/b.png') == []
+        assert pack.deduplicate() == {}
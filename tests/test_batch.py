@@ -0,0 +1,63 @@
+import io
+import json
+import pathlib
+
+import pytest
+
+from openpack import batch
+
+ref = pathlib.Path(__file__).parent / 'ref'
+
+
+@pytest.fixture
+def packages(tmp_path):
+    "A directory of packages, one of them corrupt"
+    for name in 'sample.docx', 'sample.xlsx':
+        tmp_path.joinpath(name).write_bytes(ref.joinpath(name).read_bytes())
+    tmp_path.joinpath('nested').mkdir()
+    tmp_path.joinpath('nested', 'corrupt.pptx').write_bytes(b'not a zip file')
+    tmp_path.joinpath('notes.txt').write_text('not a package')
+    return tmp_path
+
+
+def test_find_packages(packages):
+    found = batch.find_packages([str(packages), str(packages / '*.xlsx')])
+    assert [pathlib.Path(path).relative_to(packages).as_posix() for path in found] == [
+        'sample.docx',
+        'sample.xlsx',
+        'nested/corrupt.pptx',
+        'sample.xlsx',
+    ]
+
+
+@pytest.mark.parametrize('workers', [0, 2])
+def test_run_isolates_errors(packages, workers):
+    out = io.StringIO()
+    progress = []
+    paths = batch.find_packages([str(packages)])
+    errors = batch.run(
+        'validate', paths, workers, out=out, report=lambda *args: progress.append(args)
+    )
+    assert errors == 1
+    lines = list(map(json.loads, out.getvalue().splitlines()))
+    assert [line['result']['valid'] for line in lines[:2]] == [True, True]
+    assert lines[2]['error'].startswith('BadZipFile')
+    assert progress[-1] == (3, 3, 1)
+
+
+@pytest.mark.parametrize('operation', sorted(batch.operations))
+def test_operations(operation):
+    result = batch.process(operation, str(ref / 'sample.docx'))
+    assert 'error' not in result
+    json.dumps(result, default=batch._serialize)
+
+
+def test_parts():
+    result = batch.parts(str(ref / 'sample.docx'))
+    assert {
+        'name': '/word/document.xml',
+        'content_type': (
+            'application/vnd.openxmlformats-officedocument'
+            '.wordprocessingml.document.main+xml'
+        ),
+    } in result
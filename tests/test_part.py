@@ -1,4 +1,5 @@
 import pytest
+from lxml.etree import fromstring
 
 from openpack.basepack import Package, Part
 
@@ -10,3 +11,76 @@ class TestParts:
     def test_bad_names(self):
         with pytest.raises(ValueError):
             Part(Package(), 'something')
+
+
+class TestTree:
+    def test_parsed_once(self):
+        package = Package()
+        part = Part(package, '/doc.xml', data=b'<doc><p/></doc>')
+        tree = part.tree
+        assert tree.tag == 'doc'
+        assert part.tree is tree
+        assert '/doc.xml' in package.tree_cache
+        # the data is saved as it was, not re-serialized
+        assert part.dump() == b'<doc><p/></doc>'
+
+    def test_invalidated_on_load(self):
+        package = Package()
+        part = Part(package, '/doc.xml', data=b'<doc/>')
+        tree = part.tree
+        part.load(b'<other/>')
+        assert '/doc.xml' not in package.tree_cache
+        assert part.tree is not tree
+        assert part.tree.tag == 'other'
+
+    def test_replaced_part(self):
+        package = Package()
+        assert Part(package, '/doc.xml', data=b'<doc/>').tree.tag == 'doc'
+        assert Part(package, '/doc.xml', data=b'<new/>').tree.tag == 'new'
+
+    def test_budget(self):
+        package = Package()
+        package.tree_cache.max_bytes = 30
+        parts = [
+            Part(package, f'/part{n}.xml', data=b'<part>%d</part>' % n)
+            for n in range(3)
+        ]
+        assert [part.tree.text for part in parts] == ['0', '1', '2']
+        assert list(package.tree_cache._entries) == ['/part1.xml', '/part2.xml']
+        assert package.tree_cache.size == 28
+        assert parts[1].tree.text == '1'
+        assert parts[0].tree.text == '0'
+        assert list(package.tree_cache._entries) == ['/part1.xml', '/part0.xml']
+
+    def test_element_data(self):
+        package = Package()
+        part = Part(package, '/doc.xml', data=b'<doc/>')
+        part.data = part.tree
+        assert part.tree is part.data
+        assert '/doc.xml' not in package.tree_cache
+
+
+class TestDump:
+    def test_memoized(self):
+        part = Part(Package(), '/doc.xml')
+        part.data = fromstring(b'<doc/>')
+        dumped = part.dump()
+        assert part.dump() is dumped
+
+    def test_assigned(self):
+        part = Part(Package(), '/doc.xml')
+        part.data = fromstring(b'<doc/>')
+        part.dump()
+        part.data = fromstring(b'<other/>')
+        assert part.dump() == b'<other/>\n'
+        part.load('<text/>')
+        assert part.dump() == b'<text/>'
+
+    def test_changed_in_place(self):
+        part = Part(Package(), '/doc.xml')
+        part.data = fromstring(b'<doc/>')
+        part.dump()
+        part.data.append(fromstring(b'<p/>'))
+        assert part.dump() == b'<doc/>\n'
+        part.invalidate()
+        assert part.dump() == b'<doc>\n  <p/>\n</doc>\n'
@@ -1,10 +1,16 @@
+import asyncio
+import datetime
+import functools
 import io
 import os
 import pathlib
 import tempfile
+import zipfile
 
 import pytest
 
+from openpack import zippack
+from openpack.basepack import CoreProperties, Relationships, Selection
 from openpack.zippack import ZipPackage
 
 from .common import SamplePart
@@ -150,3 +156,676 @@ def test_nested_content_loads():
     assert package['/test/main.xml']
     sub = package['/test/sub.xml']
     assert b'sub module' in sub.data
+    assert package.graph.sources('/test/sub.xml') == ['/test/main.xml']
+    assert package.orphans() == []
+
+
+def test_save_prune():
+    pack = ZipPackage()
+    for name in '/test/main.xml', '/test/orphan.xml':
+        part = SamplePart(pack, name, data=b'<test/>')
+        pack.add(part)
+    pack.relate(pack['/test/main.xml'])
+    stream = io.BytesIO()
+    pack.save(stream, prune=True)
+    assert '/test/orphan.xml' not in pack
+    names = zipfile.ZipFile(stream).namelist()
+    assert 'test/main.xml' in names
+    assert 'test/orphan.xml' not in names
+    assert b'orphan' not in zipfile.ZipFile(stream).read('[Content_Types].xml')
+
+
+def test_deduplicate_lazy(writable_filename):
+    pack = ZipPackage()
+    for name, data in ('/a.xml', b'<a/>'), ('/b.xml', b'<a/>'), ('/c.xml', b'<c/>'):
+        part = SamplePart(pack, name, data=data)
+        pack.add(part)
+        pack.relate(part)
+    pack.save(writable_filename)
+    with ZipPackage.from_file(writable_filename, lazy=True) as pack:
+        assert pack.deduplicate() == {'/b.xml': '/a.xml'}
+        # only the parts that may be duplicates are read
+        assert '_data' not in vars(pack['/c.xml'])
+        assert '_data' not in vars(pack['/a.xml'])
+        pack.save()
+    pack = ZipPackage.from_file(writable_filename)
+    assert '/b.xml' not in pack
+    assert [rel.target for rel in pack.relationships] == ['a.xml', 'a.xml', 'c.xml']
+
+
+def test_lazy_load(zippack_sample_filename):
+    with ZipPackage.from_file(zippack_sample_filename, lazy=True) as pack:
+        part = pack['/test/part.xml']
+        assert '_data' not in vars(part)
+        assert part.data == b'<test>hi there</test>'
+        assert part.evict()
+        assert '_data' not in vars(part)
+        assert part.data == b'<test>hi there</test>'
+
+
+def test_lazy_load_assigned_data_not_evicted(zippack_sample):
+    pack = ZipPackage.from_stream(io.BytesIO(zippack_sample), lazy=True)
+    part = pack['/test/part.xml']
+    part.data = b'<test>changed</test>'
+    assert not part.evict()
+    pack.close()
+    assert part.data == b'<test>changed</test>'
+
+
+def test_lazy_save_in_place(writable_filename):
+    test_save(writable_filename)
+    pack = ZipPackage.from_file(writable_filename, lazy=True)
+    pack.save()
+    pack = ZipPackage.from_file(writable_filename)
+    assert pack['/test/part.xml'].data == b'<test>hi there</test>'
+
+
+def test_lazy_save_in_place_path(writable_filename):
+    "A package opened from a path is saved in place without being truncated"
+    path = pathlib.Path(writable_filename)
+    path.write_bytes(get_file('ref', 'sample.docx').read_bytes())
+    with ZipPackage.from_file(path, lazy=True) as pack:
+        pack.save()
+    saved = ZipPackage.from_file(writable_filename)
+    original = ZipPackage.from_file(get_file('ref', 'sample.docx'))
+    assert sorted(saved) == sorted(original)
+    assert saved['/word/document.xml'].data == original['/word/document.xml'].data
+
+
+def test_lazy_save_in_place_keeps_open(monkeypatch, sample_copy):
+    "Parts are still read from the open file after saving in place"
+    opened = []
+    read_directory = zipfile.ZipFile._RealGetContents
+
+    def counting(zf):
+        opened.append(zf.filename)
+        read_directory(zf)
+
+    monkeypatch.setattr(zipfile.ZipFile, '_RealGetContents', counting)
+    with ZipPackage.from_file(sample_copy, lazy=True) as pack:
+        pack.save()
+        opened.clear()
+        assert pack['/test/part.xml'].data == b'<test>hi there</test>'
+        assert opened == []
+
+
+def test_save_in_place_keeps_link_and_mode(zippack_sample, writable_filename):
+    pathlib.Path(writable_filename).write_bytes(zippack_sample)
+    os.chmod(writable_filename, 0o640)
+    link = writable_filename + '.link'
+    os.symlink(writable_filename, link)
+    try:
+        with ZipPackage.from_file(link, lazy=True) as pack:
+            pack.save()
+        assert os.path.islink(link)
+        assert os.stat(writable_filename).st_mode & 0o777 == 0o640
+        saved = ZipPackage.from_file(writable_filename)
+        assert saved['/test/part.xml'].data == b'<test>hi there</test>'
+    finally:
+        os.remove(link)
+
+
+def test_interleaved_pieces(zippack_sample):
+    """
+    The pieces of an interleaved part are joined in piece order,
+    regardless of their order in the archive.
+    """
+    source = zipfile.ZipFile(io.BytesIO(zippack_sample))
+    stream = io.BytesIO()
+    with zipfile.ZipFile(stream, 'w') as zf:
+        for name in '[Content_Types].xml', '_rels/.rels':
+            zf.writestr(name, source.read(name))
+        zf.writestr('test/part.xml/[1].last.piece', b' there</test>')
+        zf.writestr('test/part.xml/[0].piece', b'<test>hi')
+    pack = ZipPackage.from_stream(stream)
+    assert pack['/test/part.xml'].data == b'<test>hi there</test>'
+    pack = ZipPackage.from_stream(stream, lazy=True)
+    with pack, pack.open_part('/test/part.xml') as part:
+        part.seek(4)
+        assert part.read(6) == b't>hi t'
+        part.seek(-3, io.SEEK_END)
+        assert part.read() == b'st>'
+        part.seek(0)
+        assert part.read() == b'<test>hi there</test>'
+
+
+def test_open_part_streams(zippack_sample_filename):
+    with ZipPackage.from_file(zippack_sample_filename, lazy=True) as pack:
+        with pack.open_part('/test/part.xml') as part:
+            assert part.read(6) == b'<test>'
+            part.seek(-5, io.SEEK_CUR)
+            assert part.read(7) == b'test>hi'
+        assert '_data' not in vars(pack['/test/part.xml'])
+        pack['/test/part.xml'].data = b'<test>changed</test>'
+        assert pack.open_part('/test/part.xml').read() == b'<test>changed</test>'
+
+
+def test_open_part_memory_map(stored_sample_filename):
+    pack = ZipPackage.from_file(stored_sample_filename, lazy=True, memory_map=True)
+    with pack.open_part('/test/part.xml') as part:
+        assert part.read() == b'<test>hi there</test>'
+    pack.close()
+
+
+def test_open_part_write(writable_filename):
+    pack = ZipPackage()
+    part = SamplePart(pack, '/test/part.xml')
+    pack.add(part)
+    pack.relate(part)
+    with pack.open_part('/test/part.xml', 'wb') as file:
+        for n in range(10000):
+            file.write(b'<test>%d</test>\n' % n)
+    # the content can be saved repeatedly
+    pack.save(writable_filename)
+    pack.save(writable_filename)
+    data = ZipPackage.from_file(writable_filename)['/test/part.xml'].data
+    assert data.startswith(b'<test>0</test>\n<test>1</test>\n')
+    assert data.endswith(b'<test>9999</test>\n')
+    with pytest.raises(RuntimeError), pack.open_part('/test/part.xml', 'wb') as file:
+        file.write(b'<partial')
+        raise RuntimeError()
+    assert pack['/test/part.xml'].dump() == data
+    with pytest.raises(ValueError):
+        pack.open_part('/test/part.xml', 'a')
+
+
+def test_open_part_read_written():
+    "Content written to a part is read back in chunks, not joined"
+    pack = ZipPackage()
+    part = SamplePart(pack, '/test/part.xml')
+    pack.add(part)
+    with pack.open_part('/test/part.xml', 'wb') as file:
+        for n in range(10000):
+            file.write(b'<test>%d</test>\n' % n)
+    with pack.open_part('/test/part.xml') as file:
+        assert not file.seekable()
+        assert file.readline() == b'<test>0</test>\n'
+        rest = iter(functools.partial(file.read, 1000), b'')
+        assert b''.join(rest).endswith(b'<test>9999</test>\n')
+    # and can be read again
+    with pack.open_part('/test/part.xml') as file:
+        assert file.read() == part.dump()
+
+
+def test_as_chunks():
+    pack = ZipPackage()
+    part = SamplePart(pack, '/test/part.xml')
+    pack.add(part)
+    pack.relate(part)
+    part.data = (b'<test>%d</test>\n' % n for n in range(10000))
+    chunks = list(pack.as_chunks())
+    assert len(chunks) > 1
+    loaded = ZipPackage.from_stream(io.BytesIO(b''.join(chunks)))
+    data = loaded['/test/part.xml'].data
+    assert data.startswith(b'<test>0</test>\n<test>1</test>\n')
+    assert data.endswith(b'<test>9999</test>\n')
+
+
+def test_iter_dump_chunks():
+    part = SamplePart(None, '/test/part.xml', data=b'x' * 100)
+    assert [len(chunk) for chunk in part.iter_dump(chunk_size=40)] == [40, 40, 20]
+    part.data = iter(['<a>', b'</a>'])
+    assert part.dump() == b'<a></a>'
+
+
+@pytest.fixture
+def stored_sample_filename(zippack_sample, writable_filename):
+    """
+    A copy of the sample with its part stored uncompressed, which a
+    save that recompresses the part would deflate.
+    """
+    source = zipfile.ZipFile(io.BytesIO(zippack_sample))
+    with zipfile.ZipFile(writable_filename, 'w', zipfile.ZIP_DEFLATED) as zf:
+        for info in source.infolist():
+            stored = info.filename == 'test/part.xml'
+            compression = zipfile.ZIP_STORED if stored else None
+            zf.writestr(info.filename, source.read(info), compression)
+    return writable_filename
+
+
+def compress_type(stream, name):
+    return zipfile.ZipFile(stream).getinfo(name).compress_type
+
+
+@pytest.mark.parametrize('lazy', [False, True])
+def test_save_copies_unchanged_parts(stored_sample_filename, lazy):
+    pack = ZipPackage.from_file(stored_sample_filename, lazy=lazy)
+    stream = io.BytesIO()
+    pack.save(stream)
+    assert compress_type(stream, 'test/part.xml') == zipfile.ZIP_STORED
+    assert ZipPackage.from_stream(stream)['/test/part.xml'].data == (
+        b'<test>hi there</test>'
+    )
+    pack['/test/part.xml'].data = b'<test>changed</test>'
+    stream = io.BytesIO()
+    pack.save(stream)
+    assert compress_type(stream, 'test/part.xml') == zipfile.ZIP_DEFLATED
+    pack.close()
+
+
+def test_save_in_place_copies_unchanged_parts(stored_sample_filename):
+    pack = ZipPackage.from_file(stored_sample_filename, lazy=True)
+    pack.save()
+    pack.save()
+    pack.close()
+    assert compress_type(stored_sample_filename, 'test/part.xml') == (
+        zipfile.ZIP_STORED
+    )
+    pack = ZipPackage.from_file(stored_sample_filename)
+    assert pack['/test/part.xml'].data == b'<test>hi there</test>'
+
+
+def test_save_changed_file_recompresses(stored_sample_filename):
+    pack = ZipPackage.from_file(stored_sample_filename)
+    os.utime(stored_sample_filename, ns=(0, 0))
+    stream = io.BytesIO()
+    pack.save(stream)
+    assert compress_type(stream, 'test/part.xml') == zipfile.ZIP_DEFLATED
+
+
+@pytest.mark.parametrize('workers', [None, 2])
+def test_save_lazy_changed_file_raises(sample_copy, workers):
+    "Parts that can no longer be read aren't silently left out"
+    pack = ZipPackage.from_file(sample_copy, lazy=True)
+    pack.close()
+    os.utime(sample_copy, ns=(0, 0))
+    with pytest.raises(ValueError, match='no longer available'):
+        pack.save(io.BytesIO(), workers=workers)
+    with pytest.raises(ValueError, match='no longer available'):
+        pack.save(workers=workers)
+    saved = ZipPackage.from_file(sample_copy)
+    assert saved['/test/part.xml'].data == b'<test>hi there</test>'
+
+
+def test_parallel_compression_output_identical(monkeypatch, zippack_sample_filename):
+    monkeypatch.setattr(zippack.time, 'time', lambda: 1700000000.0)
+    pack = ZipPackage.from_file(zippack_sample_filename)
+    for n in range(20):
+        part = SamplePart(pack, f'/test/parallel/{n}.xml')
+        part.data = b''.join(b'<item>%d</item>' % i for i in range(n * 1000))
+        pack.add(part)
+        pack.relate(part)
+    # unchanged parts are copied in order among the compressed ones
+    assert not pack['/test/part.xml'].dirty
+    serial = pack.as_stream().getvalue()
+    assert pack.as_stream(workers=4).getvalue() == serial
+    assert b''.join(pack.as_chunks(workers=3)) == b''.join(pack.as_chunks())
+
+
+def test_save_zip64_part(monkeypatch):
+    "Parts over the zip64 limit are saved the same serially and in parallel"
+    monkeypatch.setattr(zippack.time, 'time', lambda: 1700000000.0)
+    monkeypatch.setattr(zipfile, 'ZIP64_LIMIT', 4000)
+    monkeypatch.setattr(zippack, 'ZIP64_LIMIT', 4000)
+    pack = ZipPackage()
+    part = SamplePart(pack, '/test/large.bin', data=os.urandom(5000))
+    pack.add(part)
+    pack.relate(part)
+    serial = pack.as_stream().getvalue()
+    assert pack.as_stream(workers=2).getvalue() == serial
+    saved = ZipPackage.from_stream(io.BytesIO(serial))
+    assert saved['/test/large.bin'].data == part.data
+
+
+class ImagePart(SamplePart):
+    content_type = 'image/png'
+
+
+def build_media():
+    pack = ZipPackage()
+    parts = [
+        SamplePart(pack, '/test/doc.xml', data=b'<test/>' * 1000),
+        ImagePart(pack, '/test/image.png', data=b'\x89PNG' * 1000),
+        SamplePart(pack, '/test/data.bin', data=os.urandom(2**12)),
+    ]
+    for part in parts:
+        pack.add(part)
+        pack.relate(part)
+    return pack
+
+
+@pytest.mark.parametrize('workers', [None, 2])
+def test_compression_policy(workers):
+    pack = build_media()
+    stream = pack.as_stream(workers=workers)
+    assert compress_type(stream, 'test/doc.xml') == zipfile.ZIP_DEFLATED
+    assert compress_type(stream, 'test/image.png') == zipfile.ZIP_STORED
+    assert compress_type(stream, 'test/data.bin') == zipfile.ZIP_DEFLATED
+    pack.compression = zippack.CompressionPolicy(sample=True)
+    stream = pack.as_stream(workers=workers)
+    assert compress_type(stream, 'test/data.bin') == zipfile.ZIP_STORED
+    loaded = ZipPackage.from_stream(stream)
+    assert loaded['/test/data.bin'].data == pack['/test/data.bin'].data
+
+
+def test_compression_policy_callable():
+    pack = build_media()
+    calls = []
+
+    def policy(name, content_type, size, sample):
+        calls.append((name, content_type, size))
+        return zipfile.ZIP_DEFLATED, 1
+
+    pack.compression = policy
+    stream = pack.as_stream()
+    assert ('/test/doc.xml', SamplePart.content_type, 7000) in calls
+    assert ('/test/image.png', 'image/png', 4000) in calls
+    assert compress_type(stream, 'test/image.png') == zipfile.ZIP_DEFLATED
+    assert pack.as_stream(workers=2).getvalue() == stream.getvalue()
+
+
+@pytest.mark.parametrize('method', [zipfile.ZIP_BZIP2, zipfile.ZIP_LZMA])
+def test_compression_policy_other_methods(monkeypatch, method):
+    monkeypatch.setattr(zippack.time, 'time', lambda: 1700000000.0)
+    pack = build_media()
+    pack.compression = lambda name, content_type, size, sample: (method, None)
+    stream = pack.as_stream()
+    assert compress_type(stream, 'test/doc.xml') == method
+    assert pack.as_stream(workers=2).getvalue() == stream.getvalue()
+    assert b''.join(pack.as_chunks(workers=2)) == b''.join(pack.as_chunks())
+    loaded = ZipPackage.from_stream(stream)
+    assert loaded['/test/doc.xml'].data == pack['/test/doc.xml'].data
+
+
+def test_parallel_compression_streams_chunked(monkeypatch):
+    monkeypatch.setattr(zippack.time, 'time', lambda: 1700000000.0)
+    compressed = []
+    from_part = zippack._Compressed.from_part
+
+    def spy(part, *args):
+        compressed.append(part.name)
+        return from_part(part, *args)
+
+    monkeypatch.setattr(zippack._Compressed, 'from_part', staticmethod(spy))
+    pack = ZipPackage()
+    for name in '/test/whole.xml', '/test/streamed.xml', '/test/empty.xml':
+        part = SamplePart(pack, name)
+        pack.add(part)
+        pack.relate(part)
+    pack['/test/whole.xml'].data = b'<test/>'
+    # the empty part fails to generate content, and is left out either way
+    pack['/test/streamed.xml'].data = (b'<test>%d</test>' % n for n in range(1000))
+    serial = pack.as_stream().getvalue()
+    pack['/test/streamed.xml'].data = (b'<test>%d</test>' % n for n in range(1000))
+    assert pack.as_stream(workers=2).getvalue() == serial
+    assert '/test/streamed.xml' not in compressed
+    assert '/test/whole.xml' in compressed
+
+
+@pytest.mark.parametrize('name', ['sample.docx', 'sample.xlsx'])
+def test_parallel_load(name):
+    filename = get_file('ref', name)
+    serial = ZipPackage.from_file(filename)
+    with filename.open('rb') as stream:
+        parallel = ZipPackage.from_stream(stream, workers=4)
+    assert sorted(parallel) == sorted(serial)
+    for part_name, part in serial.parts.items():
+        if isinstance(part, Relationships):
+            continue
+        assert parallel[part_name].dump() == part.dump()
+    assert parallel.core_properties.modified == serial.core_properties.modified
+    assert all(part._source is None for part in parallel.parts.values())
+
+
+def test_memory_map(stored_sample_filename):
+    pack = ZipPackage.from_file(stored_sample_filename, memory_map=True)
+    data = pack['/test/part.xml'].data
+    assert isinstance(data, memoryview)
+    assert data == b'<test>hi there</test>'
+    pack.close()
+    # the mapping remains valid while the data refers to it
+    assert data == b'<test>hi there</test>'
+    stream = io.BytesIO()
+    pack.save(stream)
+    assert ZipPackage.from_stream(stream)['/test/part.xml'].data == data
+
+
+def test_memory_map_save_in_place_path(stored_sample_filename):
+    path = pathlib.Path(stored_sample_filename)
+    pack = ZipPackage.from_file(path, memory_map=True)
+    assert pack.filename == stored_sample_filename
+    # the file is replaced, not truncated while parts refer to the mapping
+    pack.save()
+    assert pack['/test/part.xml'].data == b'<test>hi there</test>'
+    pack.close()
+    saved = ZipPackage.from_file(path)
+    assert saved['/test/part.xml'].data == b'<test>hi there</test>'
+
+
+def build_reproducible(names, reverse=False):
+    "Build a package of parts for names, adding them in either order"
+    pack = ZipPackage()
+    pack.reproducible = True
+    parts = [SamplePart(pack, name) for name in names]
+    parts.append(CoreProperties(pack, '/docProps/core.xml'))
+    for part in parts:
+        pack.relate(part)
+    for part in reversed(parts) if reverse else parts:
+        part.data = b'<test/>'
+        pack.add(part)
+    return pack
+
+
+def test_reproducible(monkeypatch):
+    names = ['/test/b.xml', '/test/a.xml']
+    first = build_reproducible(names).as_stream().getvalue()
+    monkeypatch.setattr(zippack.time, 'time', lambda: 1700000000.0)
+    second = build_reproducible(names, reverse=True).as_stream().getvalue()
+    assert first == second
+    zf = zipfile.ZipFile(io.BytesIO(first))
+    assert {info.date_time for info in zf.infolist()} == {(1980, 1, 1, 0, 0, 0)}
+    pack = ZipPackage.from_stream(io.BytesIO(first))
+    assert sorted(rel.id for rel in pack.relationships) == ['rId1', 'rId2', 'rId3']
+
+
+def test_reproducible_source_date_epoch(monkeypatch):
+    monkeypatch.setenv('SOURCE_DATE_EPOCH', '1700000000')
+    stream = build_reproducible(['/test/a.xml']).as_stream()
+    zf = zipfile.ZipFile(stream)
+    assert {info.date_time for info in zf.infolist()} == {(2023, 11, 14, 22, 13, 20)}
+    core = ZipPackage.from_stream(stream).core_properties
+    assert core.created == datetime.datetime(2023, 11, 14, 22, 13, 20)
+
+
+@pytest.fixture
+def sample_copy(zippack_sample, writable_filename):
+    pathlib.Path(writable_filename).write_bytes(zippack_sample)
+    return writable_filename
+
+
+@pytest.mark.parametrize('lazy', [False, True])
+def test_incremental_save(sample_copy, lazy):
+    before = zipfile.ZipFile(sample_copy).getinfo('test/part.xml')
+    pack = ZipPackage.from_file(sample_copy, lazy=lazy)
+    part = SamplePart(pack, '/test/other.xml')
+    part.data = b'<test>another</test>'
+    pack.relate(part)
+    pack.add(part)
+    pack.save(incremental=True)
+    zf = zipfile.ZipFile(sample_copy)
+    # the unchanged part was left where it was
+    assert zf.getinfo('test/part.xml').header_offset == before.header_offset
+    assert len(zf.namelist()) == len(set(zf.namelist()))
+    # once saved, the new part is read from the file like the others
+    assert not part.dirty
+    assert not pack.relationships.dirty
+    pack.close()
+    reloaded = ZipPackage.from_file(sample_copy)
+    assert reloaded['/test/part.xml'].data == b'<test>hi there</test>'
+    assert reloaded['/test/other.xml'].data == b'<test>another</test>'
+    assert len(reloaded.related(SamplePart.rel_type)) == 2
+
+
+def test_incremental_save_supersedes(sample_copy):
+    pack = ZipPackage.from_file(sample_copy)
+    pack['/test/part.xml'].data = b'<test>changed</test>'
+    pack.save(incremental=True)
+    grown = os.path.getsize(sample_copy)
+    assert ZipPackage.from_file(sample_copy)['/test/part.xml'].data == (
+        b'<test>changed</test>'
+    )
+    pack.compact()
+    assert os.path.getsize(sample_copy) < grown
+    assert ZipPackage.from_file(sample_copy)['/test/part.xml'].data == (
+        b'<test>changed</test>'
+    )
+
+
+class ShoutingPart(SamplePart):
+    "A part generated by dump, so always saved"
+
+    rel_type = 'http://polimetrix.com/relationships/shouting'
+
+    def dump(self):
+        return bytes(self.data).upper()
+
+
+def test_incremental_save_generated_part(writable_filename):
+    """
+    A part generated from data not yet loaded is read before the file
+    is changed, and its entry is kept unless it's replaced.
+    """
+    pack = ZipPackage()
+    for part in (
+        SamplePart(pack, '/test/part.xml', data=b'<test/>'),
+        ShoutingPart(pack, '/test/shout.xml', data=b'<test>hey</test>'),
+    ):
+        pack.add(part)
+        pack.relate(part)
+    pack.save(writable_filename)
+    with ZipPackage.from_file(writable_filename, lazy=True) as pack:
+        pack['/test/part.xml'].data = os.urandom(100_000)
+        pack.save(incremental=True)
+    reloaded = ZipPackage.from_file(writable_filename)
+    assert reloaded['/test/shout.xml'].data == b'<TEST>HEY</TEST>'
+    assert len(reloaded['/test/part.xml'].data) == 100_000
+
+
+def test_incremental_save_failed_part_kept(sample_copy):
+    "The entry of a part that fails to generate content is kept"
+    pack = ZipPackage.from_file(sample_copy, lazy=True)
+    part = pack['/test/part.xml']
+    part.data = b'<test>changed</test>'
+
+    def fail():
+        raise RuntimeError("no content")
+
+    part.iter_dump = fail
+    pack.save(incremental=True)
+    pack.close()
+    reloaded = ZipPackage.from_file(sample_copy)
+    assert reloaded['/test/part.xml'].data == b'<test>hi there</test>'
+
+
+def test_incremental_save_elsewhere(zippack_sample_filename, writable_filename):
+    "Saving incrementally to another file saves in full"
+    pack = ZipPackage.from_file(zippack_sample_filename)
+    pack.save(writable_filename, incremental=True)
+    assert ZipPackage.from_file(writable_filename)['/test/part.xml'].data == (
+        b'<test>hi there</test>'
+    )
+
+
+class AsyncWriter:
+    "An asynchronous stream collecting what's written"
+
+    def __init__(self):
+        self.stream = io.BytesIO()
+        self.drained = 0
+
+    async def write(self, data):
+        self.stream.write(data)
+
+    async def drain(self):
+        self.drained += 1
+
+
+def test_async_open_and_save(zippack_sample_filename, writable_filename):
+    async def run():
+        pack = await ZipPackage.aopen(zippack_sample_filename)
+        assert pack['/test/part.xml'].data == b'<test>hi there</test>'
+        writer = AsyncWriter()
+        await pack.asave(writer)
+        assert writer.drained
+        await pack.asave(writable_filename)
+        return writer.stream
+
+    stream = asyncio.run(run())
+    for pack in ZipPackage.from_stream(stream), ZipPackage.from_file(writable_filename):
+        assert pack['/test/part.xml'].data == b'<test>hi there</test>'
+
+
+def test_async_open_stream(zippack_sample):
+    async def run():
+        reader = asyncio.StreamReader()
+        reader.feed_data(zippack_sample)
+        reader.feed_eof()
+        return await ZipPackage.aopen(reader)
+
+    pack = asyncio.run(run())
+    part = pack['/test/part.xml']
+    assert part.data == b'<test>hi there</test>'
+    assert part.dirty
+
+
+def loaded(pack):
+    return sorted(name for name in pack if not name.endswith('.rels'))
+
+
+@pytest.mark.parametrize('lazy', [False, True])
+def test_select_depth(lazy):
+    filename = str(get_file('ref', 'sample.docx'))
+    pack = ZipPackage.from_file(filename, lazy=lazy, select=Selection(max_depth=1))
+    assert loaded(pack) == [
+        '/docProps/app.xml',
+        '/docProps/core.xml',
+        '/word/document.xml',
+    ]
+    assert pack['/word/document.xml'].data.startswith(b'<?xml')
+    with pytest.raises(ValueError):
+        pack.as_stream()
+    pack.close()
+
+
+def test_select_rel_types_and_names():
+    filename = str(get_file('ref', 'sample.docx'))
+    select = Selection(rel_types=[CoreProperties.rel_type])
+    pack = ZipPackage.from_file(filename, select=select)
+    assert loaded(pack) == ['/docProps/core.xml']
+    assert (
+        pack.core_properties.title
+        == ZipPackage.from_file(filename).core_properties.title
+    )
+    select = Selection(names=['/word/document.xml', '/WORD/HEADER*'])
+    assert loaded(ZipPackage.from_file(filename, select=select)) == [
+        '/word/document.xml',
+        '/word/header1.xml',
+        '/word/header2.xml',
+        '/word/header3.xml',
+    ]
+
+
+def test_read_core_properties():
+    pack = ZipPackage()
+    core = CoreProperties(pack, '/docProps/core.xml')
+    core.title = 'A Title'
+    core.creator = 'An Author'
+    core.modified = datetime.datetime(2020, 1, 2, 3, 4, 5)
+    pack.relate(core)
+    pack.add(core)
+    stream = pack.as_stream()
+    props = ZipPackage.read_core_properties(stream)
+    assert props.title == 'A Title'
+    assert props.creator == 'An Author'
+    assert props.modified == datetime.datetime(2020, 1, 2, 3, 4, 5)
+    assert ZipPackage.read_core_properties(ZipPackage().as_stream()) is None
+
+
+@pytest.mark.parametrize('workers', [None, 2])
+def test_iter_core_properties(workers):
+    names = 'sample.docx', 'sample.xlsx', 'sample.pptx'
+    filenames = [str(get_file('ref', name)) for name in names] * 3
+    props = list(ZipPackage.iter_core_properties(filenames, workers=workers))
+    assert [prop.created for prop in props] == [
+        ZipPackage.from_file(filename).core_properties.created for filename in filenames
+    ]